@@ -1,13 +1,23 @@
+import atexit
+import json
+import multiprocessing
 import os
+import pickle
 import random
+from concurrent.futures import ProcessPoolExecutor, Future
 from functools import wraps
 
 import dotenv
 import flask
+from eventlet.semaphore import Semaphore
 from flask import session, redirect, render_template, request, g
 from flask_socketio import SocketIO, join_room, emit
 from flask_babel import Babel, gettext, lazy_gettext as _l
+from markupsafe import Markup
 
+import cluster
+import engine
+import search
 from database import *
 from utils import *
 
@@ -55,10 +65,15 @@ def inject_locale():
 
 
 # async_mode="eventlet" важен для работы в асинхронном режиме
-socketio = SocketIO(app, ping_timeout=1, ping_interval=1, async_mode="eventlet", cors_allowed_origins="*",
+# Очередь сообщений между воркерами (см. cluster.py).
+# Пинги Engine.IO редкие: за присутствием игроков следит PresenceTracker, а исход партии
+# при пропаже игрока решают часы партии
+socketio = SocketIO(app, ping_interval=int(os.getenv("SOCKETIO_PING_INTERVAL", 25)),
+                    ping_timeout=int(os.getenv("SOCKETIO_PING_TIMEOUT", 20)),
+                    async_mode="eventlet", cors_allowed_origins="*",
                     # logger=True,          # для отладки
                     #     engineio_logger=True  # детальные логи
-                    )
+                    **cluster.socketio_options(os.getenv("SOCKETIO_MESSAGE_QUEUE")))
 
 # @app.before_request
 # def check_session_version():
@@ -67,16 +82,90 @@ socketio = SocketIO(app, ping_timeout=1, ping_interval=1, async_mode="eventlet",
 #         session["version"] = app.config["SESSION_VERSION"]
 
 
-games: Database[Game] = Database(Game, "games.db", "games")
-active_games = games
+# Кэш объектов по id поверх SQLite; записи других воркеров видны в нем не позже чем через DB_CACHE_TTL
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", 5.0))
+games: Database[Game] = Database(Game, "games.db", "games", indexes={
+    "status": ["status", "id"],
+    "player_x": ["json_extract(players, '$[0]')"],
+    "player_o": ["json_extract(players, '$[1]')"],
+}, cache_size=int(os.getenv("GAMES_CACHE_SIZE", 1024)), cache_ttl=DB_CACHE_TTL)
+# Журнал ходов: одна короткая вставка на ход
+moves: Database[Move] = Database(Move, "games.db", "moves", indexes={
+    "game_ply": ["game_id", "ply"],
+})
+# Партии игрока: одна вставка на партию, последние партии — один проход по индексу
+player_games: Database[PlayerGame] = Database(PlayerGame, "games.db", "player_games", indexes={
+    "player_game": ["player_id", "game_id DESC"],
+})
+# Активные игры живут в памяти. Строка игры в БД — периодический снимок,
+# ходы после снимка восстанавливаются из журнала moves
+active_games: WriteBehindStore[Game] = WriteBehindStore(games, flush_interval=5.0,
+                                                        start_background_task=socketio.start_background_task,
+                                                        sleep=socketio.sleep)
+# Партии, которыми владеет этот воркер: только он держит их в active_games и ведет их часы
+leases = cluster.GameLeases("games.db")
 timers: dict[int: ExtendableTimer] = {}
-players: Database[Player] = Database(Player, "players.db", "players")
+# Часы всех партий в одной фоновой задаче socketio: флаг падает и рассылается из цикла eventlet
+timer_service = TimerService(socketio.start_background_task, socketio.server.eio.create_event)
+# Обработчики событий одной партии (ход, время, сдача, часы, бот) выполняются по очереди
+game_locks = StripedLocks(int(os.getenv("GAME_LOCK_STRIPES", 64)), lock_factory=Semaphore)
+GAMES_PAGE_SIZE = 50
+GAME_SUMMARY_COLUMNS = ["id", "players", "status", "winner", "fen"]
+players: Database[Player] = Database(Player, "players.db", "players", indexes={
+    "username": ["username"],
+}, cache_size=int(os.getenv("PLAYERS_CACHE_SIZE", 10_000)), cache_ttl=DB_CACHE_TTL)
+
+BOT_USERNAME = "Bot"
+BOT_TIME_LIMIT = float(os.getenv("BOT_TIME_LIMIT", 1.0))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 2))
+BOT_POLL_INTERVAL = 0.02
+bot_pool: Optional[ProcessPoolExecutor] = None
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 2))
+# Бюджет на весь запрос анализа; позиции, не уложившиеся в него, возвращаются как null
+ANALYSIS_DEADLINE = float(os.getenv("ANALYSIS_DEADLINE", 10.0))
+ANALYSIS_TIME_LIMIT = 0.2
+ANALYSIS_MAX_TIME_LIMIT = 2.0
+ANALYSIS_MAX_POSITIONS = 500
+ANALYSIS_POLL_INTERVAL = 0.02
+analysis_pool: Optional[ProcessPoolExecutor] = None
+# (хеш Zobrist позиции, режим) -> (бюджет поиска, результат search.analyse); результат
+# годится для запросов с бюджетом не больше того, с которым он получен
+analysis_cache = LRUCache(int(os.getenv("ANALYSIS_CACHE_SIZE", 100_000)))
+# id завершенной партии -> Game.positions(); завершенные партии не меняются
+replay_cache = LRUCache(int(os.getenv("REPLAY_CACHE_SIZE", 1024)))
+# id игрока -> username. Кэшируются только заданные имена: имя появляется один раз при
+# регистрации и дальше не меняется, поэтому кэш не устаревает и на других воркерах
+username_cache = LRUCache(int(os.getenv("USERNAME_CACHE_SIZE", 10_000)))
+# id анонимных игроков (имя None). Имя появится при регистрации, возможно на другом
+# воркере, поэтому запись живет не дольше DB_CACHE_TTL
+anonymous_cache = LRUCache(int(os.getenv("USERNAME_CACHE_SIZE", 10_000)), ttl=DB_CACHE_TTL)
+# Отрисованные карточки партий (game_card в components/macros.html). Карточка завершенной
+# партии больше не меняется, поэтому такие карточки живут в отдельном кэше до вытеснения
+ended_cards = LRUCache(int(os.getenv("ENDED_CARDS_CACHE_SIZE", 10_000)))
+live_cards = LRUCache(int(os.getenv("LIVE_CARDS_CACHE_SIZE", 1024)))
+# Уборка анонимных игроков без партий (см. collect_anonymous_players)
+PLAYER_GC_INTERVAL = float(os.getenv("PLAYER_GC_INTERVAL", 3600))
+PLAYER_GC_GRACE = float(os.getenv("PLAYER_GC_GRACE", 3600))
+
+
+def get_bot_player_id() -> int:
+    """id служебного игрока-бота; без пароля, поэтому войти под ним нельзя."""
+    found = players.query({"username": BOT_USERNAME}, columns=["id"], limit=1)
+    if found:
+        return found[0]["id"]
+    return players.append(Player(BOT_USERNAME, None))
+
+
+bot_player_id = get_bot_player_id()
 
 
 def create_game(player_0: int, player_piece: str, use_time: bool = False, duration: int = 0,
-                addition: int = 0, random_start=False) -> Game:
+                addition: int = 0, random_start=False, bot: Optional[str] = None) -> Game:
     game_players = [None, None]
     game_players[player_piece == "O"] = player_0
+    if bot:
+        game_players[player_piece != "O"] = bot_player_id
     game = Game(
         id=len(games),
         players=game_players,
@@ -84,16 +173,333 @@ def create_game(player_0: int, player_piece: str, use_time: bool = False, durati
         left_time=[duration * 60, duration * 60],
         time_addition=addition,
         last_move_time=-1,
+        bot=bot,
     )
     if random_start:
         grid = generate_random_start_position()
         game.grid = grid
-    game_id = games.append(game)
-    game.id = game_id
-    games[game_id] = game
+        game.start_fen = game.fen
+    # Партию с ботом запускает первый запрос /game/<id>: его, в отличие от POST /create_game,
+    # балансировщик направляет к воркеру, который будет владеть партией (см. cluster.py)
+    game.id = games.append(game)
     return game
 
 
+def start_game(game: Game) -> bool:
+    """
+    Переводит игру в ACTIVE: запускает часы и переносит игру в реестр активных.
+    Возвращает False, если аренду партии держит другой воркер: тогда игра не меняется.
+    """
+    if not leases.acquire(game.id):
+        return False
+    game.status = ACTIVE
+    game.last_move_time = datetime.datetime.now()
+
+    if game.use_time:
+        timers[game.id] = ExtendableTimer(game.left_time[0], lose_by_time, args=[game, 0],
+                                         service=timer_service)
+        timers[game.id].start()
+
+    active_games[game.id] = game
+    active_games.flush()
+    if is_bot_turn(game):
+        request_bot_move(game)
+    return True
+
+
+def fork_pool(workers: int) -> ProcessPoolExecutor:
+    # fork: spawn заново импортировал бы app.py в каждом рабочем процессе
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+
+
+def get_bot_pool() -> ProcessPoolExecutor:
+    global bot_pool
+    if bot_pool is None:
+        bot_pool = fork_pool(BOT_WORKERS)
+    return bot_pool
+
+
+def get_analysis_pool() -> ProcessPoolExecutor:
+    """Отдельный от бота пул, чтобы разбор длинных партий не задерживал ходы бота."""
+    global analysis_pool
+    if analysis_pool is None:
+        analysis_pool = fork_pool(ANALYSIS_WORKERS)
+    return analysis_pool
+
+
+def is_bot_turn(game: Game) -> bool:
+    return bool(game.bot) and game.status == ACTIVE and game.players[game.step] == bot_player_id
+
+
+def request_bot_move(game: Game):
+    """Запускает поиск хода бота в пуле процессов, не блокируя обработчики событий."""
+    ply = len(game.pgn)
+    future = get_bot_pool().submit(search.best_move, game.fen, mode=game.bot, time_limit=BOT_TIME_LIMIT)
+    socketio.start_background_task(on_bot_move, game.id, ply, future)
+
+
+def on_bot_move(game_id: int, ply: int, future: Future):
+    """
+    Применяет найденный ботом ход, если за время поиска позиция не изменилась.
+    Работает в фоновой задаче socketio: ход рассылается из цикла eventlet, а не из
+    потока пула, откуда события до клиентов не доходят.
+    """
+    # Ждем через socketio.sleep, как analyse_positions
+    while not future.done():
+        socketio.sleep(BOT_POLL_INTERVAL)
+    if not leases.owns(game_id):
+        return
+    try:
+        result = future.result()
+    except Exception:
+        traceback.print_exc()
+        return
+    with game_locks.hold(game_id):
+        game = active_games[game_id]
+        if game is None or game.status != ACTIVE or len(game.pgn) != ply or result["move"] is None:
+            return
+        row, col = engine.MOVE_ROW_COL[result["move"]]
+        play_move(game, game.step, row, col)
+
+
+def analyse_positions(fens: list[str], mode: str, time_limit: float) -> tuple[list[Optional[dict]], bool]:
+    """
+    Оценивает позиции в пуле процессов с общим дедлайном ANALYSIS_DEADLINE.
+    Повторяющиеся позиции считаются один раз, результаты кэшируются по хешу позиции
+    вместе с бюджетом поиска: кэш отвечает только на запросы с бюджетом не больше.
+
+    Returns:
+        (результаты по порядку fens, None для не успевших; все ли позиции оценены)
+    """
+    deadline = time.time() + ANALYSIS_DEADLINE
+    results: list[Optional[dict]] = [None] * len(fens)
+    tasks: dict[tuple[int, str], tuple[Future, list[int]]] = {}
+    for index, fen in enumerate(fens):
+        key = (engine.Board.from_fen(fen).hash, mode)
+        cached = analysis_cache.get(key)
+        if cached is not None and cached[0] >= time_limit:
+            results[index] = cached[1]
+        elif key in tasks:
+            tasks[key][1].append(index)
+        else:
+            future = get_analysis_pool().submit(search.analyse, fen, mode, time_limit, deadline)
+            tasks[key] = (future, [index])
+
+    # Ждем через socketio.sleep, чтобы не блокировать остальные обработчики
+    while time.time() < deadline and not all(future.done() for future, _ in tasks.values()):
+        socketio.sleep(ANALYSIS_POLL_INTERVAL)
+
+    complete = True
+    for key, (future, indexes) in tasks.items():
+        result = None
+        if future.done():
+            try:
+                result = future.result()
+            except Exception:
+                traceback.print_exc()
+        else:
+            future.cancel()
+        if result is None:
+            complete = False
+            continue
+        budget = result["time_limit"]
+        result = {
+            "move": engine.MOVE_ROW_COL[result["move"]] if result["move"] is not None else None,
+            "score": result["score"],
+            "depth": result.get("depth"),
+            "nodes": result["nodes"],
+        }
+        analysis_cache[key] = (budget, result)
+        for index in indexes:
+            results[index] = result
+    return results, complete
+
+
+def game_positions(game: Game) -> list[str]:
+    """Все позиции партии; для завершенных партий результат запоминается по id."""
+    if game.status != ENDED:
+        return game.positions()
+    fens = replay_cache.get(game.id)
+    if fens is None:
+        fens = game.positions()
+        replay_cache[game.id] = fens
+    return fens
+
+
+def games_page(before: Optional[int] = None, status: Optional[str] = None, player: Optional[int] = None,
+               limit: int = GAMES_PAGE_SIZE, columns: Optional[list[str]] = None):
+    """
+    Страница игр от новых к старым с курсором по id.
+    Возвращает (игры, курсор следующей страницы или None).
+    """
+    condition = {}
+    if before is not None:
+        condition["id <"] = before
+    if status is not None:
+        condition["status"] = status
+        if status == WAITING:
+            # Партия с ботом ждет не второго игрока, а первого открытия (см. create_game)
+            condition["bot"] = None
+    where = condition
+    if player is not None:
+        # Игрок мог играть за любую сторону: два индексированных условия через OR
+        where = [dict(condition, player_x=player), dict(condition, player_o=player)]
+
+    page = games.query(where, order_by="id DESC", limit=limit + 1, columns=columns)
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, page[-1]["id"] if columns is not None else page[-1].id
+
+
+def migrate_player_games():
+    """
+    Одноразовый перенос списков партий игроков из старой схемы, где они хранились
+    в столбце players.games, в таблицу player_games. После переноса столбец обнуляется.
+    Столбец — JSON, если таблица была в нативных типах, или pickle, если ее перенесла
+    из самого старого формата Database._migrate_legacy.
+    """
+    if "games" not in {row[1] for row in players.conn.execute("PRAGMA table_info(players)")}:
+        return
+    rows = players.conn.execute("SELECT id, games FROM players WHERE games IS NOT NULL").fetchall()
+    if not rows:
+        return
+    if not player_games.query(columns=["id"], limit=1):
+        with player_games.transaction():
+            for player_id, game_ids in rows:
+                game_ids = json.loads(game_ids) if isinstance(game_ids, str) else pickle.loads(game_ids)
+                for game_id in game_ids:
+                    player_games.append(PlayerGame(player_id=player_id, game_id=game_id))
+    with players.transaction():
+        players.cursor.execute("UPDATE players SET games = NULL")
+
+
+def restore_active_games():
+    """
+    Загружает в память свои партии при запуске воркера: аренды с его WORKER_ID. Чужие партии
+    он берет, только когда их направляет сюда балансировщик (см. claim_game). Активные партии
+    без строки аренды (созданные до появления аренд) получают просроченную аренду.
+    """
+    for game_id in leases.held():
+        adopt_leased(game_id)
+    leases.seed([row["id"] for row in games.query({"status": ACTIVE}, columns=["id"], order_by=None)])
+
+
+def adopt_leased(game_id: int):
+    """
+    Берет аренду партии и восстанавливает партию из БД мимо кэша; аренду завершенной партии
+    отпускает. Вызывается под game_locks, кроме запуска воркера.
+    """
+    if game_id in active_games or not leases.acquire(game_id):
+        return
+    found = games.query({"id": game_id}, limit=1)
+    if found and found[0].status == ACTIVE:
+        adopt_game(found[0])
+    else:
+        leases.release(game_id)
+
+
+def adopt_game(game: Game):
+    """
+    Восстанавливает партию в памяти: снимок из таблицы games плюс ходы из журнала после него.
+    Затем заново запускает часы.
+    """
+    active_games.keep(game.id, game)
+    tail = moves.query({"game_id": game.id, "ply >=": len(game.pgn)}, order_by="ply")
+    for move in tail:
+        wins = game.play(move.cell // 9, move.cell % 9)
+        game.left_time = move.left_time
+        if game.use_time:
+            game.last_move_time = move.created_at
+        if wins:
+            game.status = ENDED
+            game.winner = (game.step + 1) % 2
+    if game.status == ENDED:
+        active_games.finish(game.id, game)
+        leases.release(game.id)
+        return
+    if tail:
+        active_games[game.id] = game
+    if game.use_time and isinstance(game.last_move_time, datetime.datetime):
+        elapsed = (datetime.datetime.now() - game.last_move_time).total_seconds()
+        timers[game.id] = ExtendableTimer(max(0.0, game.left_time[game.step] - elapsed), lose_by_time,
+                                          [game, game.step], service=timer_service)
+        timers[game.id].start()
+    if is_bot_turn(game):
+        request_bot_move(game)
+
+
+def adopt_expired_games():
+    """
+    Подхватывает партии упавших воркеров: находит их по просроченным арендам, не перебирая
+    активные партии. Просроченную аренду сначала дает подхватить воркеру, к которому
+    балансировщик направляет переподключившихся клиентов (см. claim_game).
+    """
+    for game_id in leases.expired(grace=leases.ttl):
+        with game_locks.hold(game_id):
+            adopt_leased(game_id)
+
+
+def claim_game(game_id: int) -> Optional[Game]:
+    """
+    Партия для запроса, пришедшего к этому воркеру: балансировщик направляет ее запросы сюда.
+    Активную партию без живой аренды (владелец упал или отдал ее) воркер сразу подхватывает,
+    партию с живой чужой аренды просит передать (см. hand_over_games). Вызывается под game_locks.
+    """
+    if game_id not in active_games:
+        game = active_games[game_id]
+        if game is not None and game.status == ACTIVE:
+            adopt_leased(game_id)
+            if not leases.owns(game_id):
+                leases.request(game_id)
+    return active_games[game_id]
+
+
+def owns_game(game_id: int) -> bool:
+    """Ведет ли партию этот воркер; чужую партию сначала пробует получить (см. claim_game)."""
+    if not leases.owns(game_id):
+        claim_game(game_id)
+    return leases.owns(game_id)
+
+
+def hand_over_games():
+    """Отдает партии, которые попросили воркеры, получающие их запросы от балансировщика."""
+    requested = leases.requested()
+    if requested:
+        # Снимок в БД до передачи: новый владелец восстановит партию из него и журнала ходов
+        active_games.flush()
+    for game_id in requested:
+        with game_locks.hold(game_id):
+            drop_game(game_id)
+            leases.hand_over(game_id)
+
+
+def drop_game(game_id: int):
+    """Убирает из памяти партию, которую теперь ведет другой воркер: он же ведет ее часы."""
+    timer = timers.pop(game_id, None)
+    if timer is not None:
+        timer.cancel()
+    active_games.evict(game_id)
+
+
+def lease_heartbeat():
+    """Продлевает аренды своих партий и подхватывает партии воркеров, не продлевших аренду."""
+    while True:
+        socketio.sleep(leases.ttl / 3)
+        try:
+            for game_id in leases.renew():
+                drop_game(game_id)
+            hand_over_games()
+            adopt_expired_games()
+        except Exception:
+            traceback.print_exc()
+
+
+def shutdown():
+    active_games.flush()
+    leases.release_all()
+
+
 def generate_random_start_position():
     # Создаем массив 9x9 заполненный нулями
     board = [[None for _ in range(9)] for _ in range(9)]
@@ -126,19 +532,83 @@ def generate_random_start_position():
     return board
 
 
+def ensure_player() -> int:
+    """
+    id игрока сессии. Анонимный посетитель живет только в подписанной сессии, строка
+    в players появляется здесь — когда он создает партию, входит в нее или регистрируется.
+    """
+    player_id = session.get("player_id")
+    # Строку могла удалить уборка анонимных игроков
+    if player_id is None or players[player_id] is None:
+        player_id = players.append(Player(None, None, created_at=datetime.datetime.now()))
+        session["player_id"] = player_id
+    return player_id
+
+
 def auth_player(function):
+    """Создает строку игрока сессии перед обработчиком (см. ensure_player)."""
     @wraps(function)
     def wrapper(*args, **kwargs):
-        if session.get("player_id") is None:
-            player = Player(None, None)
-            player_id = players.append(player)
-            session["player_id"] = player_id
-            print(f"AUTH NEW PLAYER = {players[player_id]}")
+        ensure_player()
         return function(*args, **kwargs)
 
     return wrapper
 
 
+def collect_anonymous_players():
+    """
+    Удаляет анонимных игроков без партий, созданных раньше PLAYER_GC_GRACE секунд назад
+    (строки старых версий, создававших игрока на каждую сессию, не имеют created_at).
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=PLAYER_GC_GRACE)
+    removed = 0
+    batch = []
+    for player in players.scan({"username": None}):
+        if player.created_at is None or player.created_at < cutoff:
+            batch.append(player.id)
+        if len(batch) >= players.batch_size:
+            removed += delete_players_without_games(batch)
+            batch = []
+    if batch:
+        removed += delete_players_without_games(batch)
+    return removed
+
+
+def delete_players_without_games(player_ids: list[int]) -> int:
+    with_games = {row["player_id"] for row in player_games.query(
+        {"player_id in": player_ids}, columns=["player_id"], order_by=None
+    )}
+    # Сами партии тоже проверяем: у игроков из старых версий может не быть строк player_games
+    for row in games.query([{"player_x in": player_ids}, {"player_o in": player_ids}],
+                           columns=["players"], order_by=None):
+        with_games.update(row["players"])
+    orphans = [player_id for player_id in player_ids if player_id not in with_games]
+    with players.transaction():
+        for player_id in orphans:
+            del players[player_id]
+    return len(orphans)
+
+
+def player_gc():
+    """Периодическая уборка анонимных игроков (см. collect_anonymous_players)."""
+    while True:
+        socketio.sleep(PLAYER_GC_INTERVAL)
+        try:
+            collect_anonymous_players()
+        except Exception:
+            traceback.print_exc()
+
+
+def per_game(function):
+    """Выполняет обработчик события под блокировкой партии data["game_id"]."""
+    @wraps(function)
+    def wrapper(data, *args, **kwargs):
+        with game_locks.hold(int(data.get("game_id"))):
+            return function(data, *args, **kwargs)
+
+    return wrapper
+
+
 def validator(schema):
     def decorator(function):
         @wraps(function)
@@ -162,49 +632,70 @@ def validator(schema):
 def positive(x):
     return isinstance(x, int) and x >= 0
 
-def desk_is_full(desk):
-    for i in range(3):
-        for j in range(3):
-            if desk[i][j] is None:
-                return False
-    return True
+
+def full_state(game: Game) -> dict:
+    """Полное состояние для update_state; seq — номер последней отправленной дельты."""
+    return dict(game.get_state_for_client(), seq=game.seq)
+
+
+def spectator_snapshot(game_id: int) -> Optional[dict]:
+    game = active_games[game_id]
+    return full_state(game) if game is not None else None
 
 
-def player_wins(desk):
-    lines = [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]]
-    line_desk = desk[0] + desk[1] + desk[2]
-    for [a, b, c] in lines:
-        if line_desk[a] == line_desk[b] == line_desk[c] is not None:
-            return True
-    return False
+# Зрители получают не дельты, а периодические снимки (см. SpectatorFeed)
+spectator_feed = SpectatorFeed(socketio, spectator_snapshot, window=float(os.getenv("SPECTATOR_WINDOW", 0.25)))
 
 
-def make_move(grid, row, col, mark):
-    grid[row][col] = mark
-    desk = [
-        [grid[i][j] for j in range((col // 3) * 3, (col // 3 + 1) * 3)]
-        for i in range((row // 3) * 3, (row // 3 + 1) * 3)
-    ]
-    if player_wins(desk):
-        return grid, True
-    if desk_is_full(desk):
-        for i in range((row // 3) * 3, (row // 3 + 1) * 3):
-            for j in range((col // 3) * 3, (col // 3 + 1) * 3):
-                grid[i][j] = None
-    return grid, False
+def presence_state(game: Game, online: frozenset[int]) -> dict:
+    return {"online": [player_id is not None and player_id in online for player_id in game.players]}
+
+
+def broadcast_presence(game_id: int, online: frozenset[int]):
+    """Рассылает, кто из игроков на связи; вызывается только при изменении."""
+    game = active_games[game_id]
+    if game is None:
+        return
+    state = presence_state(game, online)
+    socketio.emit("presence", state, to=f"game-{game_id}")
+    socketio.emit("presence", state, to=SpectatorFeed.room(game_id))
+
+
+# Интервалы heartbeat клиентов по ролям, секунды
+HEARTBEAT_INTERVALS = {
+    "player": float(os.getenv("HEARTBEAT_PLAYER", 10)),
+    "spectator": float(os.getenv("HEARTBEAT_SPECTATOR", 60)),
+    "lobby": float(os.getenv("HEARTBEAT_LOBBY", 60)),
+}
+presence = PresenceTracker(socketio, HEARTBEAT_INTERVALS, broadcast_presence)
 
 
 def broadcast_game_state(game_id: int):
-    """Отправляет полное состояние игры всем в комнате."""
+    """Отправляет полное состояние игры всем в комнате (при смене состава игроков)."""
     game = active_games[game_id]
     # "to" указывает, в какую комнату отправлять событие
-    socketio.emit("update_state", game.get_state_for_client(), to=f"game-{game_id}")
-    # print(f"Broadcasted game state: {game.get_state_for_client()}")
+    socketio.emit("update_state", full_state(game), to=f"game-{game_id}")
+    spectator_feed.publish(game_id)
+
+
+def broadcast_delta(game: Game, **delta):
+    """
+    Отправляет в комнату только изменившуюся часть состояния с очередным номером seq.
+    Клиент, заметивший пропуск номера, запрашивает полное состояние событием resync.
+
+    Поля дельты: move — [row, col] сделанного хода, cleared — очищена ли заполненная
+    мини-доска этого хода, left_time/last_move_time — часы, status/winner — конец партии.
+    Вызывается после изменения партии: seq — уже новый game.seq.
+    """
+    delta["seq"] = game.seq
+    socketio.emit("delta", delta, to=f"game-{game.id}")
+    spectator_feed.publish(game.id)
 
 
 def lose_game(game: Game, loser_mark):
     game.status = ENDED
     game.winner = (loser_mark + 1) % 2
+    game.add_event()
     # del active_games[game.game_id]
     if game.use_time:
         try:
@@ -212,77 +703,113 @@ def lose_game(game: Game, loser_mark):
         finally:
             del timers[game.id]
 
-    games[game.id] = game
-    broadcast_game_state(game.id)
+    active_games.finish(game.id, game)
+    leases.release(game.id)
+    broadcast_delta(game, status=ENDED, winner=game.winner, **game.get_clock_for_client())
 
 
 def lose_by_time(game, player_mark):
-    game.left_time[player_mark] = 0
-    lose_game(game, player_mark)
+    with game_locks.hold(game.id):
+        game = active_games[game.id]
+        # Ход мог прийти, пока вызов ждал блокировку: тогда часы уже перезапущены
+        if game is None or game.status != ACTIVE or game.step != player_mark:
+            return
+        game.left_time[player_mark] = 0
+        lose_game(game, player_mark)
 
 
 @app.context_processor
 def inject_variables():
-    return dict(players=players, games=games, player_id=session.get("player_id"))
+    return dict(games=games, player_id=session.get("player_id"), render_game_card=render_game_card)
 
 
 @socketio.on("add_time")
 @validator({"game_id": positive, "player_id": positive})
-@auth_player
+@per_game
 def on_add_time(data):
     game_id = data.get("game_id")
     player_id = data.get("player_id")
     if player_id != session.get("player_id"):
         return {"error": 401}
+    if not owns_game(game_id):
+        return {"error": 409}
     if timers.get(game_id) is None:
         return {"error": 405}
-    if player_id not in games[game_id].players:
+    game = active_games[game_id]
+    if player_id not in game.players:
         return {"error": 403}
-    game = games[game_id]
-    player_side = games[game_id].players.index(player_id)
+    player_side = game.players.index(player_id)
     other_player_side = (player_side + 1) % 2
     game.left_time[other_player_side] += 15
-    games[game_id] = game
+    game.add_event()
+    active_games[game_id] = game
+    # Счетчик событий входит в seq: сразу в БД, чтобы новый владелец партии продолжил нумерацию
+    active_games.flush()
     if game.step == other_player_side:
         print("ADDING TIME")
         timer: ExtendableTimer = timers.get(game_id)
         print(timer.start_time + timer.interval)
         timer.extend(15)
-    broadcast_game_state(game_id)
+    broadcast_delta(game, **game.get_clock_for_client())
 
 
 @socketio.on("join")
 @validator({"game_id": positive})
-@auth_player
 def on_join(data):
-    """Клиент присоединяется к комнате игры."""
+    """Клиент присоединяется к комнате игры: игроки — к game-{id}, зрители — к spectate-{id}."""
     game_id = int(data.get("game_id"))
-    game = active_games[game_id]
+    with game_locks.hold(game_id):
+        game = claim_game(game_id)
     if game is None:
         return
-    room_name = f"game-{game_id}"
+    player_id = session.get("player_id")
+    if player_id is not None and player_id in game.players:
+        room_name = f"game-{game_id}"
+        role = "player" if game.status == ACTIVE else "lobby"
+    else:
+        room_name = SpectatorFeed.room(game_id)
+        role = "spectator"
+        player_id = None
     join_room(room_name)
     # Сразу после подключения отправим ему актуальное состояние
-    emit("update_state", game.get_state_for_client())
+    emit("update_state", full_state(game))
+    # Если с подключением игрок появится онлайн, изменение придет и в комнату
+    emit("presence", presence_state(game, presence.online(game_id)))
+    emit("heartbeat_interval", {"interval": presence.connect(request.sid, game_id, player_id, role)})
 
 
-def validate_move(game: Game, move):
-    active_mini = game.active_mini
-    if not (active_mini // 3 * 3 <= move[0] < active_mini // 3 * 3 + 3 and active_mini % 3 * 3 <= move[
-        1] < active_mini % 3 * 3 + 3):
-        return False
-    return True
+@socketio.on("heartbeat")
+def on_heartbeat(data=None):
+    presence.touch(request.sid)
+
+
+@socketio.on("disconnect")
+def on_disconnect(reason=None):
+    presence.disconnect(request.sid)
+    spectator_feed.forget(request.sid)
+
+
+@socketio.on("resync")
+@validator({"game_id": positive})
+def on_resync(data):
+    """Полное состояние по запросу клиента, пропустившего дельту."""
+    game = active_games[int(data.get("game_id"))]
+    if game is None:
+        return
+    emit("update_state", full_state(game))
 
 
 @socketio.on("resign")
 @validator({"game_id": positive, "player_id": positive})
-@auth_player
+@per_game
 def on_resign_fn(data):
     player_id = data.get("player_id")
     if player_id != session.get("player_id"):
         return {"error": 403}
     game_id = data.get("game_id")
-    game = games[game_id]
+    if not owns_game(game_id):
+        return {"error": 409}
+    game = active_games[game_id]
     if game is None:
         return {"error": 403}
     if player_id not in game.players:
@@ -292,11 +819,14 @@ def on_resign_fn(data):
 
 @socketio.on("move")
 @validator({"game_id": positive, "row": positive, "col": positive})
-@auth_player
+@per_game
 def on_move_fn(data):
     """Обработка хода, полученного через WebSocket."""
     game_id, row, col = int(data.get("game_id")), data.get("row"), data.get("col")
     player = session.get("player_id")
+    if not owns_game(game_id):
+        # Партией владеет другой воркер (см. cluster.py)
+        return {"error": 409}
 
     try:
         game: Game = active_games[game_id]
@@ -308,17 +838,21 @@ def on_move_fn(data):
     if game is None or game.status != ACTIVE or player not in game.players: return {"error": 400}
 
     player_mark = 0 if game.players[0] == player else 1
-    other_player_mark = (player_mark + 1) % 2
     if game.step != player_mark:
         # Это не его ход
         return {"error": 400}
 
-    if game.grid[row][col] is not None:
-        # Клетка занята
+    if row > 8 or col > 8 or not game.board.is_legal(engine.MOVE_INDEX[row][col]):
+        # Клетка занята или вне активной мини-доски
         return {"error": 400}
 
-    if not validate_move(game, (row, col)):
-        return {"error": 400}
+    return play_move(game, player_mark, row, col)
+
+
+def play_move(game: Game, player_mark: int, row: int, col: int):
+    """Применяет проверенный ход: часы, доска, журнал ходов и рассылка состояния."""
+    game_id = game.id
+    other_player_mark = (player_mark + 1) % 2
 
     if game.use_time:
         cur_time = datetime.datetime.now()
@@ -332,70 +866,212 @@ def on_move_fn(data):
         if game.left_time[player_mark] <= 0:
             return lose_game(game, player_mark)
 
-        timers[game_id] = ExtendableTimer(game.left_time[other_player_mark], lose_by_time, [game, other_player_mark])
+        timers[game_id] = ExtendableTimer(game.left_time[other_player_mark], lose_by_time, [game, other_player_mark],
+                                            service=timer_service)
         timers[game_id].start()
 
-    grid, wins = make_move(game.grid, row, col, ["X", "O"][player_mark])
-    game.add_step(3 * (row % 3) + (col % 3))
-    game.grid = grid
+    ply = len(game.pgn)
+    mini = engine.MOVE_INDEX[row][col] // 9
+    wins = game.play(row, col)
     game.left_time[player_mark] += game.time_addition
+    moves.append(Move(game_id=game_id, ply=ply, cell=9 * row + col, left_time=list(game.left_time),
+                      created_at=game.last_move_time if game.use_time else datetime.datetime.now()))
+    board = game.board
+    broadcast_delta(game, move=[row, col], cleared=not (board.x[mini] | board.o[mini]),
+                    **game.get_clock_for_client())
 
     if wins:
         return lose_game(game, other_player_mark)
 
-    games[game_id] = game
-    broadcast_game_state(game_id)
+    active_games[game_id] = game
+    if is_bot_turn(game):
+        request_bot_move(game)
+
+
+def latest_player_games(player_id: Optional[int], limit: int) -> list[Game]:
+    """Последние limit партий игрока, новые первыми."""
+    if player_id is None:
+        return []
+    game_ids = [row["game_id"] for row in player_games.query(
+        {"player_id": player_id}, order_by="game_id DESC", limit=limit, columns=["game_id"]
+    )]
+    if not game_ids:
+        return []
+    return games.query({"id in": game_ids}, order_by="id DESC")
+
+
+def usernames_for(game_list) -> dict[int, Optional[str]]:
+    """
+    id -> username всех игроков партий для шаблонов (см. components/macros.html).
+    Имена, которых нет в username_cache и anonymous_cache, читаются одним запросом IN (...).
+    """
+    ids = {player_id for game in game_list if game for player_id in game.players if player_id}
+    result = {}
+    missing = []
+    for player_id in ids:
+        username = username_cache.get(player_id)
+        if username is None and anonymous_cache.get(player_id) is None:
+            missing.append(player_id)
+        result[player_id] = username
+    if missing:
+        for row in players.query({"id in": missing}, columns=["id", "username"], order_by=None):
+            result[row["id"]] = row["username"]
+            if row["username"] is not None:
+                username_cache[row["id"]] = row["username"]
+        for player_id in missing:
+            if result[player_id] is None:
+                anonymous_cache[player_id] = True
+    return result
+
+
+def render_game_card(game: Game, usernames: dict[int, Optional[str]]) -> Markup:
+    """
+    game_card из кэша фрагментов. Ключ — (id, fen, язык) и все, что еще попадает
+    в карточку: победитель и имена игроков.
+    """
+    key = (game.id, game.fen, get_locale(), game.winner, tuple(usernames.get(i) for i in game.players))
+    cache = ended_cards if game.status == ENDED else live_cards
+    html = cache.get(key)
+    if html is None:
+        html = Markup(flask.get_template_attribute("components/macros.html", "game_card")(game, usernames))
+        cache[key] = html
+    return html
 
 
 @app.route("/")
 @validator({})
-@auth_player
 def home():
-    last_games = games.get_by("status", WAITING)[::-1]
-    if len(last_games) > 5:
-        last_games = last_games[:5]
-    player_games = [games[game_id] for game_id in players[session.get("player_id")].games[::-1]]
-    if len(player_games) > 10:
-        player_games = player_games[:10]
-    return render_template("index.html", last_games=last_games, player_games=player_games, player=players[session.get("player_id")])
+    last_games = games.query({"status": WAITING, "bot": None}, order_by="id DESC", limit=5)
+    player_games = latest_player_games(session.get("player_id"), limit=10)
+    return render_template("index.html", last_games=last_games, player_games=player_games,
+                           usernames=usernames_for(last_games + player_games),
+                           player=players[session.get("player_id")])
 
 
 @app.route("/invite/<int:game_id>")
 @validator({})
-@auth_player
 def on_invite(game_id: int):
-    if session.get("player_id") in games[game_id].players:
+    game = active_games[game_id]
+    if session.get("player_id") is not None and session.get("player_id") in game.players:
         return redirect(f"/game/{game_id}")
-    return render_template("invite.html", game=games[game_id], player=players[session.get("player_id")])
+    return render_template("invite.html", game=game, usernames=usernames_for([game]),
+                           player=players[session.get("player_id")])
 
 
 @app.route("/analysis")
 @validator({})
-@auth_player
 def on_analysis():
     game_id = request.args.get('game_id', type=int)
     game = None
     
     if isinstance(game_id, int) and game_id > 0:
         try:
-            game = games[game_id]
+            game = active_games[game_id]
         except (IndexError, KeyError):
             pass  # Игра не найдена, game остается None
     
-    return render_template("analysis.html", game=game, player=players[session.get("player_id")])
+    return render_template("analysis.html", game=game, usernames=usernames_for([game]),
+                           player=players[session.get("player_id")])
 
 
 @app.route("/all_games")
 @validator({})
-@auth_player
 def on_all_games_fn():
-    last_games = games[::-1]
-    return render_template("all_games.html", last_games=last_games, player=players[session.get("player_id")])
+    last_games, next_cursor = games_page(before=request.args.get("before", type=int))
+    return render_template("all_games.html", last_games=last_games, next_cursor=next_cursor,
+                           usernames=usernames_for(last_games), player=players[session.get("player_id")])
+
+
+@app.route("/api/games", methods=["GET"])
+@validator({})
+def on_api_games_fn():
+    status = request.args.get("status")
+    if status is not None and status not in (WAITING, ACTIVE, ENDED):
+        return {"error": "invalid_request"}, 400
+    limit = request.args.get("limit", GAMES_PAGE_SIZE, type=int)
+    if not 0 < limit <= GAMES_PAGE_SIZE:
+        return {"error": "invalid_request"}, 400
+    page, next_cursor = games_page(
+        before=request.args.get("before", type=int),
+        status=status,
+        player=request.args.get("player", type=int),
+        limit=limit,
+        columns=GAME_SUMMARY_COLUMNS,
+    )
+    return {"games": page, "next": next_cursor}
+
+
+@app.route("/api/games/<int:game_id>/positions", methods=["GET"])
+@validator({})
+def on_api_game_positions_fn(game_id: int):
+    try:
+        game = active_games[game_id]
+    except IndexError:
+        game = None
+    if game is None:
+        return {"error": 404}, 404
+    try:
+        fens = game_positions(game)
+    except ValueError:
+        # Позиции партии не восстановить по pgn (см. Game.positions)
+        return {"error": "unknown_positions"}, 409
+    return {"game_id": game.id, "pgn": game.pgn, "fens": fens}
+
+
+@app.route("/api/metrics", methods=["GET"])
+@validator({})
+def on_api_metrics_fn():
+    """Глубина очередей событий партий, размер реестров в памяти и работа кэшей."""
+    return {
+        "game_locks": game_locks.stats(),
+        "active_games": len(active_games),
+        "timers": len(timers),
+        "caches": {
+            "games": games.cache.stats(),
+            "players": players.cache.stats(),
+            "usernames": username_cache.stats(),
+            "anonymous": anonymous_cache.stats(),
+            "ended_cards": ended_cards.stats(),
+            "live_cards": live_cards.stats(),
+        },
+    }
+
+
+@app.route("/api/analysis", methods=["POST"])
+@validator({
+    "fens": lambda x: isinstance(x, list) and 0 < len(x) <= ANALYSIS_MAX_POSITIONS and all(map(engine.is_fen, x)),
+    "pgn": lambda x: isinstance(x, str) and len(x) < ANALYSIS_MAX_POSITIONS and all(c in "012345678" for c in x),
+    "fen": engine.is_fen,
+    "mode": lambda x: x in search.SEARCH_MODES,
+    "time_limit": lambda x: type(x) in (int, float) and 0 < x <= ANALYSIS_MAX_TIME_LIMIT,
+})
+def on_api_analysis_fn():
+    """
+    Оценка списка позиций за один запрос: {"fens": [...]} или {"pgn": ..., "fen": начальная позиция}.
+    Для pgn оцениваются начальная позиция и позиция после каждого хода.
+    """
+    data = request.json
+    if "fens" in data:
+        fens = data["fens"]
+    elif "pgn" in data:
+        try:
+            fens = engine.replay(data["pgn"], data.get("fen", engine.START_FEN))
+        except ValueError:
+            return {"error": "invalid_pgn"}, 400
+    else:
+        return {"error": "invalid_request"}, 400
+
+    results, complete = analyse_positions(
+        fens, data.get("mode", "alphabeta"), data.get("time_limit", ANALYSIS_TIME_LIMIT)
+    )
+    return {
+        "positions": [dict(result, fen=fen) if result else None for fen, result in zip(fens, results)],
+        "complete": complete,
+    }
 
 
 @app.route("/logout", methods=["GET"])
 @validator({})
-@auth_player
 def on_get_logout_fn():
     session["player_id"] = None
     return redirect(request.referrer or '/')
@@ -411,16 +1087,15 @@ def set_language(language):
 
 @app.route("/login", methods=["GET"])
 @validator({})
-@auth_player
 def on_get_login_fn():
     return render_template("login.html")
 
 
 @app.route("/login", methods=["POST"])
 @validator({"username": str, "password": str})
-@auth_player
 def on_post_login_fn():
-    player = players.get_by("username", request.json.get("username"))[0]
+    found = players.query({"username": request.json.get("username")}, limit=1)
+    player = found[0] if found else None
     if player is None or player.password != request.json.get("password"):
         return {"error": "invalid_credentials"}, 401
     print(f"Logged new {player = }")
@@ -430,17 +1105,15 @@ def on_post_login_fn():
 
 @app.route("/signup", methods=["GET"])
 @validator({})
-@auth_player
 def on_get_signup_fn():
     return render_template("login.html", registration=True)
 
 
 @app.route("/signup", methods=["POST"])
 @validator({"username": str, "password": str})
-@auth_player
 def on_post_signup_fn():
     username: str = request.json.get("username")
-    if players.get_by("username", username):
+    if players.query({"username": username}, columns=["id"], limit=1):
         return {"error": "username_taken"}, 401
     if not isinstance(username, str) or len(username) > 30 or len(username) < 3:
         return {"error": "username is invalid"}, 401
@@ -453,9 +1126,11 @@ def on_post_signup_fn():
         if i.isspace() or i == "ㅤ":
             return {"error": "username is invalid"}, 401
 
-    player = Player(username=request.json.get("username"), password=password,
-                    id=session.get("player_id"))
-    players[session.get("player_id")] = player
+    player_id = ensure_player()
+    players[player_id] = Player(username=username, password=password, id=player_id,
+                                created_at=datetime.datetime.now())
+    username_cache.pop(player_id)
+    anonymous_cache.pop(player_id)
     return "200"
 
 
@@ -465,12 +1140,12 @@ def on_post_signup_fn():
     "duration": positive,
     "addition": positive,
     "player_piece": lambda x: x in ["X", "O"],
-    "use_random_start": lambda x: isinstance(x, bool)
+    "use_random_start": lambda x: isinstance(x, bool),
+    "bot": lambda x: x is None or x in search.SEARCH_MODES,
 })
 @auth_player
 def on_create_game_fn():
     player_id = session.get("player_id")
-    player = players[player_id]
     game = create_game(
         player_0=player_id,
         use_time=request.json.get("use_time"),
@@ -478,9 +1153,9 @@ def on_create_game_fn():
         addition=max(0, request.json.get("addition", 0)),
         player_piece=request.json.get("player_piece"),
         random_start=request.json.get("use_random_start"),
+        bot=request.json.get("bot"),
     )
-    player.games.append(game.id)
-    players[player_id] = player
+    player_games.append(PlayerGame(player_id=player_id, game_id=game.id))
     return {"game_id": f"{game.id}"}
 
 
@@ -488,7 +1163,14 @@ def on_create_game_fn():
 @validator({})
 @auth_player
 def on_join(game_id: int):
-    game: Game = games[game_id]
+    with game_locks.hold(game_id):
+        return join_game(game_id)
+
+
+def join_game(game_id: int):
+    # Мимо кэша: устаревшая копия WAITING-партии отдала бы уже занятое место
+    found = games.query({"id": game_id}, limit=1)
+    game: Optional[Game] = found[0] if found else None
     if game is None:
         return redirect("/")
     if game.status != WAITING:
@@ -501,25 +1183,22 @@ def on_join(game_id: int):
     if game.players[0] is not None and game.players[1] is not None:
         return redirect("/")
 
-    if game.players[0] is None:
-        game.players[0] = player_id
-    else:
-        game.players[1] = player_id
-
-    # Добавляем игру в список игр игрока
-    player = players[player_id]
-    player.games.append(game_id)
-    players[player_id] = player
+    if not leases.acquire(game_id):
+        # Партию ведет другой воркер: запрос пришел мимо балансировщика
+        return {"error": 409}
 
-    games[game_id] = game
-    game.status = ACTIVE
-    game.last_move_time = datetime.datetime.now()
+    seated = list(game.players)
+    game.players[game.players[0] is not None] = player_id
+    # Место занимается, только если партия в БД все еще ждет с тем же составом игроков
+    if not games.update({"id": game_id, "status": WAITING, "players": seated}, {"players": game.players}):
+        if game_id not in active_games:
+            leases.release(game_id)
+        return redirect(f"/game/{game_id}")
 
-    if game.use_time:
-        timers[game_id] = ExtendableTimer(game.left_time[0], lose_by_time, args=[game, 0])
-        timers[game_id].start()
+    player_games.append(PlayerGame(player_id=player_id, game_id=game_id))
 
-    active_games[game_id] = game
+    if not start_game(game):
+        return {"error": 409}
     socketio.start_background_task(target=broadcast_game_state, game_id=game_id)
 
     return redirect(f"/game/{game_id}")
@@ -527,34 +1206,51 @@ def on_join(game_id: int):
 
 @app.route("/game/<int:game_id>", methods=["GET"])
 @validator({})
-@auth_player
 def on_game_fn(game_id: int):
     try:
-        game: Game = games[game_id]
+        with game_locks.hold(game_id):
+            game: Game = claim_game(game_id)
+            if game is not None and game.status == WAITING and game.bot and None not in game.players:
+                # Партия с ботом создана и ждет первого открытия у своего воркера
+                if not start_game(game):
+                    return {"error": 409}
     except IndexError:
         return {"error": 404}
     if game is None:
         return redirect("/")
-    player_id = session["player_id"]
+    player_id = session.get("player_id")
+    usernames = usernames_for([game])
 
     if game.status == ENDED:
-        return render_template("ended_game.html", game=game, player=players[session.get("player_id")])
+        return render_template("ended_game.html", game=game, usernames=usernames,
+                               player=players[session.get("player_id")])
 
     is_player = player_id in game.players
 
     if game.status == ACTIVE:
         if is_player:
-            return render_template("active_game.html", game=game, player=players[session.get("player_id")])
-        return render_template("active_game.html", game=game, player=players[session.get("player_id")], spectator=True)
+            return render_template("active_game.html", game=game, usernames=usernames,
+                                   player=players[session.get("player_id")])
+        return render_template("active_game.html", game=game, usernames=usernames,
+                               player=players[session.get("player_id")], spectator=True)
 
     if game.status == WAITING:
-        return render_template("waiting_game.html", game=game, player=players[session.get("player_id")])
+        return render_template("waiting_game.html", game=game, usernames=usernames,
+                               player=players[session.get("player_id")])
 
     return redirect(f"/")
 
 
+migrate_player_games()
+restore_active_games()
+spectator_feed.start()
+presence.start()
+socketio.start_background_task(lease_heartbeat)
+socketio.start_background_task(player_gc)
+atexit.register(shutdown)
+
 if __name__ == "__main__":
     if os.getenv('TEST'):
-        socketio.run(app, host="0.0.0.0", port=5000, debug=True)
+        socketio.run(app, host="0.0.0.0", port=cluster.PORT, debug=True)
     else:
-        socketio.run(app, host="127.0.0.1", port=5000, debug=False)
+        socketio.run(app, host="127.0.0.1", port=cluster.PORT, debug=False)
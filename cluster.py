@@ -0,0 +1,243 @@
+"""
+Запуск нескольких процессов-воркеров.
+
+- События Socket.IO между воркерами идут через очередь сообщений из SOCKETIO_MESSAGE_QUEUE:
+  redis://, kafka://, amqp:// и т.п. обслуживает сам Flask-SocketIO, sqlite:///path —
+  локальный брокер SQLiteQueueManager (воркеры на одной машине, тесты). Без переменной
+  воркер работает один, как раньше.
+- Каждой активной партией владеет один воркер: он держит ее в active_games и ведет ее часы.
+  Владение — аренда в таблице leases, которую владелец периодически продлевает. Воркер,
+  перезапущенный с тем же WORKER_ID, получает свои аренды обратно сразу, аренды упавшего
+  воркера по истечении LEASE_TTL подхватывают остальные.
+- Балансировщик направляет все запросы партии к одному воркеру по ее id: из пути для
+  /game/<id>, /join_game/<id>, /invite/<id> и /api/games/<id>/..., из параметра game_id
+  для Socket.IO (game.js и spectator.js передают его при подключении). В nginx, например:
+      map $uri $game_key { ~^/(?:game|join_game|invite|api/games)/(\d+) $1; default $arg_game_id; }
+      hash $game_key consistent;
+  Аренду новой партии берет воркер, обработавший запрос с ее id, поэтому партия с ботом
+  запускается при первом открытии /game/<id>, а не в POST /create_game. Воркер без аренды
+  партию не запускает и ходы в ней не принимает (ошибка 409).
+- Владение следует за маршрутизацией: воркер, получивший запрос партии с чужой арендой,
+  просит ее передать (wanted_by в leases), и владелец отдает партию при следующем
+  продлении аренд. Так партия, подхваченная «не тем» воркером после падения или
+  перезапуска, возвращается к воркеру, которому ее направляет балансировщик.
+"""
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import socketio
+
+PORT = int(os.getenv("PORT", 5000))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{PORT}"
+LEASE_TTL = float(os.getenv("LEASE_TTL", 15.0))
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class SQLiteQueueManager(socketio.PubSubManager):
+    """
+    Очередь сообщений Socket.IO в таблице SQLite: публикация — вставка строки,
+    прием — опрос строк с id больше последнего прочитанного. Старые сообщения
+    удаляются через retention секунд.
+    """
+    name = "sqlite"
+
+    def __init__(self, url: str = "sqlite:///socketio.db", channel: str = "socketio", write_only: bool = False,
+                 logger=None, poll_interval: float = 0.02, retention: float = 60.0):
+        self.db_path = url[len("sqlite:///"):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._conn = connect(self.db_path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS socketio_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        self._lock = threading.Lock()
+        self._published = 0
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO socketio_messages (channel, created_at, data) VALUES (?, ?, ?)",
+                (self.channel, now, pickle.dumps(data))
+            )
+            self._published += 1
+            if self._published % 1000 == 0:
+                self._conn.execute("DELETE FROM socketio_messages WHERE created_at < ?", (now - self.retention,))
+
+    def _listen(self):
+        conn = connect(self.db_path)
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM socketio_messages").fetchone()[0]
+        while True:
+            rows = conn.execute(
+                "SELECT id, data FROM socketio_messages WHERE id > ? AND channel = ? ORDER BY id",
+                (last_id, self.channel)
+            ).fetchall()
+            for last_id, data in rows:
+                yield data
+            if not rows:
+                # sleep сервера: под eventlet не блокирует остальные гринлеты
+                self.server.sleep(self.poll_interval)
+
+
+def socketio_options(url: Optional[str]) -> dict:
+    """Аргументы SocketIO(...) для очереди сообщений из SOCKETIO_MESSAGE_QUEUE."""
+    if not url:
+        return {}
+    if url.startswith("sqlite:///"):
+        return {"client_manager": SQLiteQueueManager(url)}
+    return {"message_queue": url}
+
+
+class GameLeases:
+    """
+    Аренда владения партиями: строка (game_id, worker, expires_at, wanted_by) в таблице leases.
+    Захват атомарен (один UPSERT), поэтому из двух воркеров аренду получит один.
+    wanted_by — воркер, попросивший передать ему партию (см. request).
+    """
+
+    def __init__(self, db_path: str, worker_id: str = WORKER_ID, ttl: float = LEASE_TTL):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.owned: set[int] = set()
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                game_id INTEGER PRIMARY KEY,
+                worker TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                wanted_by TEXT
+            )
+        ''')
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(leases)")}
+        if "wanted_by" not in columns:
+            self._conn.execute("ALTER TABLE leases ADD COLUMN wanted_by TEXT")
+
+    def acquire(self, game_id: int) -> bool:
+        """Захват аренды: свободной, просроченной или уже своей."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (game_id, worker, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (game_id) DO UPDATE SET worker = excluded.worker, expires_at = excluded.expires_at, "
+                "wanted_by = NULL WHERE leases.worker = excluded.worker OR leases.expires_at < ?",
+                (game_id, self.worker_id, now + self.ttl, now)
+            )
+            if cursor.rowcount == 1:
+                self.owned.add(game_id)
+                return True
+            self.owned.discard(game_id)
+            return False
+
+    def release(self, game_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE game_id = ? AND worker = ?", (game_id, self.worker_id))
+            self.owned.discard(game_id)
+
+    def renew(self) -> set[int]:
+        """Продлевает все свои аренды. Возвращает партии, аренду которых перехватил другой воркер."""
+        with self._lock:
+            # Отданные партии (expires_at = 0, см. hand_over) не продлеваются
+            self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE worker = ? AND expires_at > 0",
+                (time.time() + self.ttl, self.worker_id)
+            )
+            held = {row[0] for row in self._conn.execute(
+                "SELECT game_id FROM leases WHERE worker = ?", (self.worker_id,)
+            )}
+            lost = self.owned - held
+            self.owned &= held
+            return lost
+
+    def owns(self, game_id: int) -> bool:
+        return game_id in self.owned
+
+    def release_all(self) -> None:
+        """
+        Освобождает все свои аренды, чтобы партии сразу подхватили другие воркеры.
+        Строки остаются просроченными: по ним expired() находит брошенные партии.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE leases SET expires_at = ? WHERE worker = ?", (time.time(), self.worker_id))
+            self.owned.clear()
+
+    def expired(self, grace: float = 0.0) -> list[int]:
+        """
+        Партии чужих аренд, истекших больше grace секунд назад (их владелец не продлил аренду),
+        и переданные этому воркеру по его просьбе — сразу.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT game_id FROM leases WHERE worker != ? AND (expires_at < ? OR wanted_by = ? AND expires_at < ?)",
+                (self.worker_id, now - grace, self.worker_id, now)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def held(self) -> list[int]:
+        """
+        Партии, записанные за этим воркером, включая просроченные (после перезапуска),
+        кроме тех, что он отдает другому воркеру.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT game_id FROM leases WHERE worker = ? AND (wanted_by IS NULL OR wanted_by = worker)",
+                (self.worker_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def seed(self, game_ids: list[int]) -> None:
+        """Просроченные аренды для партий без строки в leases: их подхватывают как брошенные."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO leases (game_id, worker, expires_at) VALUES (?, '', 0)",
+                [(game_id,) for game_id in game_ids]
+            )
+
+    def request(self, game_id: int) -> None:
+        """Просит владельца передать партию этому воркеру: к нему ее направляет балансировщик."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE leases SET wanted_by = ? WHERE game_id = ? AND worker != ?",
+                (self.worker_id, game_id, self.worker_id)
+            )
+
+    def requested(self) -> list[int]:
+        """Свои партии, которые попросил передать другой воркер."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT game_id FROM leases WHERE worker = ? AND wanted_by IS NOT NULL AND wanted_by != ?",
+                (self.worker_id, self.worker_id)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def hand_over(self, game_id: int) -> None:
+        """Отдает партию попросившему воркеру: аренда истекает, wanted_by сохраняется."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE leases SET expires_at = 0 WHERE game_id = ? AND worker = ?", (game_id, self.worker_id)
+            )
+            self.owned.discard(game_id)
+
+    def owner(self, game_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT worker FROM leases WHERE game_id = ? AND expires_at >= ?", (game_id, time.time())
+            ).fetchone()
+        return row[0] if row else None
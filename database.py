@@ -1,5 +1,12 @@
+import copy
+import json
 import pickle
 import sqlite3
+import threading
+import time
+import traceback
+import typing
+from contextlib import contextmanager
 from dataclasses import fields, asdict
 from typing import Type, Generic, TypeVar, Union, Iterator, Any
 
@@ -7,61 +14,435 @@ from utils import *
 
 T = TypeVar('T')
 
+SCHEMA_VERSION = 1
+
+QUERY_OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "in")
+
+
+class Codec:
+    """
+    Преобразование значения поля датакласса в нативный тип SQLite и обратно.
+    Базовый класс хранит значение как есть; None всегда хранится как NULL.
+    """
+    sql_type = "BLOB"
+
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+
+class IntegerCodec(Codec):
+    sql_type = "INTEGER"
+
+
+class BoolCodec(Codec):
+    sql_type = "INTEGER"
+
+    def encode(self, value):
+        return None if value is None else int(value)
+
+    def decode(self, value):
+        return None if value is None else bool(value)
+
+
+class RealCodec(Codec):
+    sql_type = "REAL"
+
+
+class TextCodec(Codec):
+    sql_type = "TEXT"
+
+
+class JsonCodec(Codec):
+    """Списки и словари храним как компактный JSON."""
+    sql_type = "TEXT"
+
+    def encode(self, value):
+        return None if value is None else json.dumps(value, separators=(",", ":"))
+
+    def decode(self, value):
+        return None if value is None else json.loads(value)
+
+
+class DatetimeCodec(Codec):
+    """
+    datetime храним как unix timestamp (REAL).
+    Числовые значения-заглушки (например, last_move_time = -1) сохраняются как есть.
+    """
+    sql_type = "REAL"
+
+    def encode(self, value):
+        if isinstance(value, datetime.datetime):
+            return value.timestamp()
+        return value
+
+    def decode(self, value):
+        if value is None or value < 0:
+            return None if value is None else int(value)
+        return datetime.datetime.fromtimestamp(value)
+
+
+class PickleCodec(Codec):
+    """Запасной вариант для типов, у которых нет нативного представления."""
+    sql_type = "BLOB"
+
+    def encode(self, value):
+        return None if value is None else pickle.dumps(value)
+
+    def decode(self, value):
+        return None if value is None else pickle.loads(value)
+
+
+class ConnectionPool:
+    """
+    Соединения с одной БД: единственный писатель и переиспользуемые соединения для чтения.
+    Каждый поток/гринлет на время чтения получает собственное соединение, поэтому
+    параллельные запросы не делят один курсор. В режиме WAL читатели не блокируют писателя.
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 8):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.writer = sqlite3.connect(db_path, check_same_thread=False)
+        # БД в памяти видна только своему соединению — читаем через писателя
+        self.shared = db_path != ":memory:"
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Выдача соединения для чтения на время блока with."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect_reader()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        self.writer.close()
+
+
+def codec_for(py_type) -> Codec:
+    """Подбор кодека по аннотации поля датакласса."""
+    # Optional[X] / Union[X, None] сводим к X
+    if typing.get_origin(py_type) is Union:
+        args = [i for i in typing.get_args(py_type) if i is not type(None)]
+        if len(args) == 1:
+            py_type = args[0]
+    origin = typing.get_origin(py_type) or py_type
+    if origin is bool:
+        return BoolCodec()
+    if origin is int:
+        return IntegerCodec()
+    if origin is float:
+        return RealCodec()
+    if origin is str:
+        return TextCodec()
+    if origin is bytes:
+        return Codec()
+    if origin in (list, tuple, dict):
+        return JsonCodec()
+    if origin is datetime.datetime:
+        return DatetimeCodec()
+    return PickleCodec()
+
 
 class Database(Generic[T]):
     """
     Класс для работы с SQLite базой данных с интерфейсом как у list.
-    Хранит данные любого типа, сериализуя их в JSON или pickle.
+    Поля датакласса хранятся в нативных типах SQLite (см. codec_for).
     """
+    # Размер пачки строк при потоковом обходе (см. scan)
+    batch_size = 500
 
-    def __init__(self, item_type: Type[T], db_path: str = ":memory:", table_name: str = "data"):
+    def __init__(self, item_type: Type[T], db_path: str = ":memory:", table_name: str = "data",
+                 indexes: Optional[dict[str, list[str]]] = None, group_commit: Optional[float] = None,
+                 group_commit_size: int = 100, synchronous: str = "NORMAL",
+                 cache_size: Optional[int] = None, cache_ttl: Optional[float] = None):
         """
         Инициализация базы данных.
 
         Args:
             db_path: Путь к файлу БД или ':memory:' для БД в памяти
             table_name: Имя таблицы для хранения данных
+            indexes: Вторичные индексы: имя -> список столбцов или SQL-выражений.
+                Индекс из одного выражения можно использовать по имени в query()
+            group_commit: Окно группового коммита в секундах. Если задано, записи вне
+                transaction() фиксируются одним коммитом по истечении окна
+            group_commit_size: Максимум записей в одном групповом коммите
+            synchronous: Значение PRAGMA synchronous для файловой БД в режиме WAL
+            cache_size: Размер LRU-кэша объектов по id для self[id]; None — без кэша.
+                Запись через этот объект сбрасывает кэш, записи других процессов
+                видны не позже чем через cache_ttl
+            cache_ttl: Время жизни записи кэша в секундах; None — без ограничения
         """
         self.item_type = item_type
         self.db_path = db_path
         self.table_name = table_name
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.pool = ConnectionPool(db_path)
+        # Соединение и курсор писателя; чтение идет через self._read
+        self.conn = self.pool.writer
         self.cursor = self.conn.cursor()
+        if db_path != ":memory:":
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute(f"PRAGMA synchronous={synchronous}")
+        self.lock = threading.RLock()
+        self.group_commit = group_commit
+        self.group_commit_size = group_commit_size
+        self._depth = 0
+        self._owner = None
+        self._began = False
+        self._pending = 0
+        self._flush_timer = None
+        self.cache = LRUCache(cache_size, cache_ttl) if cache_size else None
+        # Номер версии кэша растет при каждом сбросе (см. _invalidate, _cache_put)
+        self._cache_version = 0
+        self._cache_lock = threading.Lock()
+        # id, записанные в текущей транзакции; None — весь кэш
+        self._stale: set[Optional[int]] = set()
         self.dataclass_fields = [i for i in fields(self.item_type) if i.name != "id"]
+        type_hints = typing.get_type_hints(self.item_type)
+        self.codecs = {field.name: codec_for(type_hints[field.name]) for field in self.dataclass_fields}
+        self.columns = "id, " + ", ".join(field.name for field in self.dataclass_fields)
+        self.indexes = indexes or {}
         self._create_table()
+        self._create_indexes()
 
-    def _get_sql_type(self, py_type: Type) -> str:
-        """Простое сопоставление типов Python с типами SQLite."""
-        # Для простоты и гибкости:
-        if py_type is int:
-            return 'INTEGER'
-        if py_type is float:
-            return 'REAL'
-        # Все остальное (str, list, dict, custom objects, Optional, Union) храним как TEXT
-        return 'TEXT'
+    def _table_exists(self, table_name: str) -> bool:
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return self.cursor.fetchone() is not None
 
     def _create_table(self):
-        """Динамическое создание таблицы на основе полей датакласса."""
+        """
+        Динамическое создание таблицы на основе полей датакласса.
+        Создание и миграция идут одной транзакцией (DDL в SQLite транзакционен):
+        при сбое посередине таблица остается в прежнем виде и миграция повторится.
+        """
+        self.cursor.execute("BEGIN")
+        try:
+            self.cursor.execute(
+                "CREATE TABLE IF NOT EXISTS _schema (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            self.cursor.execute("SELECT version FROM _schema WHERE table_name = ?", (self.table_name,))
+            row = self.cursor.fetchone()
 
-        column_definitions = ["id INTEGER PRIMARY KEY AUTOINCREMENT"]
+            if row is None and self._table_exists(f"{self.table_name}_legacy"):
+                # Миграция прошлой версии прервалась после переименования: данные целиком
+                # в _legacy, а новая таблица пуста — начинаем миграцию заново
+                self.cursor.execute(f"DROP TABLE IF EXISTS {self.table_name}")
+                self.cursor.execute(f"ALTER TABLE {self.table_name}_legacy RENAME TO {self.table_name}")
+            if row is None and self._table_exists(self.table_name):
+                # Таблица создана старой версией, где каждое поле хранилось как pickle в hex
+                self._add_missing_columns(self.table_name)
+                self._migrate_legacy()
+            else:
+                self._create_data_table(self.table_name)
+                self._add_missing_columns(self.table_name)
 
-        for field in self.dataclass_fields:
-            # Извлекаем базовый тип, игнорируя Optional, Union, и т.п. для простого маппинга
-            py_type = field.type
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO _schema (table_name, version) VALUES (?, ?)",
+                (self.table_name, SCHEMA_VERSION)
+            )
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
 
-            sql_type = self._get_sql_type(py_type)
-            column_definitions.append(f"{field.name} {sql_type}")
+    def _create_data_table(self, table_name: str):
+        column_definitions = ["id INTEGER PRIMARY KEY AUTOINCREMENT"]
+        for field in self.dataclass_fields:
+            column_definitions.append(f"{field.name} {self.codecs[field.name].sql_type}")
 
         schema = ",\n".join(column_definitions)
 
         self.cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {self.table_name} (
+            CREATE TABLE IF NOT EXISTS {table_name} (
                 {schema}
             )
         ''')
+
+    def _add_missing_columns(self, table_name: str):
+        """Добавление столбцов для полей, появившихся в датаклассе после создания таблицы."""
+        self.cursor.execute(f"PRAGMA table_info({table_name})")
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for field in self.dataclass_fields:
+            if field.name not in existing:
+                self.cursor.execute(
+                    f"ALTER TABLE {table_name} ADD COLUMN {field.name} {self.codecs[field.name].sql_type}"
+                )
+
+    def _create_indexes(self):
+        """Создание объявленных вторичных индексов."""
+        for name, expressions in self.indexes.items():
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table_name}_{name}_idx "
+                f"ON {self.table_name} ({', '.join(expressions)})"
+            )
         self.conn.commit()
 
-    def _serialize(self, item: T) -> tuple[list[str, Any], list[str]]:
+    def _migrate_legacy(self):
+        """Одноразовая миграция таблицы из формата pickle+hex в нативные типы."""
+        legacy_table = f"{self.table_name}_legacy"
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table_name,))
+        row = self.cursor.fetchone()
+        last_id = row[0] if row else 0
+
+        self.cursor.execute(f"ALTER TABLE {self.table_name} RENAME TO {legacy_table}")
+        self._create_data_table(self.table_name)
+
+        # Столбцы полей, которых уже нет в датаклассе, переносятся как pickle (BLOB),
+        # чтобы их данные могла забрать миграция приложения
+        self.cursor.execute(f"PRAGMA table_info({legacy_table})")
+        extra = [row[1] for row in self.cursor.fetchall() if row[1] != "id" and row[1] not in self.codecs]
+        for name in extra:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {name} BLOB")
+
+        names = [field.name for field in self.dataclass_fields]
+        select = ", ".join([self.columns] + extra)
+        rows = self.cursor.execute(f"SELECT {select} FROM {legacy_table}").fetchall()
+        for row in rows:
+            kwargs = {"id": row[0]}
+            for name, val in zip(names, row[1:]):
+                kwargs[name] = pickle.loads(bytes.fromhex(val)) if isinstance(val, str) else val
+            columns, values = self._serialize(self.item_type(**kwargs))
+            for name, val in zip(extra, row[1 + len(names):]):
+                columns.append(name)
+                values.append(pickle.dumps(pickle.loads(bytes.fromhex(val))) if isinstance(val, str) else val)
+            self.cursor.execute(
+                f"INSERT INTO {self.table_name} (id, {', '.join(columns)}) VALUES ({', '.join(['?'] * (len(columns) + 1))})",
+                [row[0]] + values
+            )
+
+        self.cursor.execute(f"DROP TABLE {legacy_table}")
+        self.cursor.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?",
+            (last_id, self.table_name, last_id)
+        )
+
+    @contextmanager
+    def transaction(self):
+        """
+        Контекстный менеджер транзакции. Все записи внутри фиксируются одним коммитом,
+        при исключении откатываются. Вложенный вызов — своя точка сохранения: исключение,
+        пойманное внешним блоком, откатывает только записи вложенного.
+        """
+        with self.lock:
+            savepoint = f"tx_{self._depth}"
+            if self._depth == 0:
+                self._owner = threading.get_ident()
+                # Открыла ли BEGIN эта транзакция (иначе открыт групповой коммит)
+                self._began = not self.conn.in_transaction
+                if self._began:
+                    self.cursor.execute("BEGIN")
+            # Точка сохранения позволяет откатить только этот блок,
+            # не трогая записи внешнего блока и ожидающие группового коммита
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0 and self._began:
+                    # Групповых записей в этой транзакции нет: откатываем ее целиком,
+                    # иначе открытый BEGIN держал бы блокировку записи БД
+                    self.conn.rollback()
+                else:
+                    self.cursor.execute(f"ROLLBACK TO {savepoint}")
+                    self.cursor.execute(f"RELEASE {savepoint}")
+                if self._depth == 0:
+                    self._owner = None
+                    self._invalidate_stale()
+                raise
+            self._depth -= 1
+            self.cursor.execute(f"RELEASE {savepoint}")
+            if self._depth == 0:
+                self._owner = None
+                self._commit()
+                self._invalidate_stale()
+
+    def _commit(self):
+        """Коммит завершенной транзакции сразу или в рамках группового коммита."""
+        if self.group_commit is None:
+            self.conn.commit()
+            return
+        self._pending += 1
+        if self._pending >= self.group_commit_size:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.group_commit, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self) -> None:
+        """Фиксация записей, ожидающих группового коммита."""
+        with self.lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._depth == 0:
+                self.conn.commit()
+                self._pending = 0
+
+    def _invalidate(self, key: Optional[int] = None) -> None:
+        """Сброс записи кэша для id key (None — всего кэша) при записи в таблицу."""
+        if self.cache is None:
+            return
+        with self._cache_lock:
+            self._cache_version += 1
+            if key is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(key)
+        if self._depth:
+            self._stale.add(key)
+
+    def _invalidate_stale(self) -> None:
+        """
+        Повторный сброс после завершения транзакции: чтение из другого потока, начатое
+        до коммита, могло вернуть старую строку и положить ее в кэш.
+        """
+        stale, self._stale = self._stale, set()
+        for key in stale:
+            self._invalidate(key)
+
+    def _cache_put(self, key: int, item: T, version: int) -> None:
+        """Кладет копию прочитанного объекта в кэш, если с начала чтения кэш не сбрасывался."""
+        with self._cache_lock:
+            if self._cache_version == version:
+                self.cache[key] = copy.deepcopy(item)
+
+    def _read(self, sql: str, params=()) -> list:
+        """
+        Выполнение читающего запроса на соединении из пула.
+        Внутри своей транзакции и при незафиксированном групповом коммите читаем
+        через писателя, чтобы видеть собственные записи.
+        """
+        if not self.pool.shared or self._owner == threading.get_ident() or self._pending:
+            with self.lock:
+                return self.conn.execute(sql, params).fetchall()
+        with self.pool.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _serialize(self, item: T) -> tuple[list[str], list[Any]]:
         """
         Сериализация объекта для хранения в БД.
 
@@ -69,44 +450,44 @@ class Database(Generic[T]):
             columns, values
         """
         obj = asdict(item)
-        obj = {i: obj[i] for i in obj.keys() if i != "id"}
-        columns = obj.keys()
-        values = []
-        for i in list(obj.values()):
-            values.append(pickle.dumps(i).hex())
+        columns = [field.name for field in self.dataclass_fields]
+        values = [self.codecs[column].encode(obj[column]) for column in columns]
         return columns, values
 
     def _deserialize(self, row) -> T:
-        """Десериализация объекта из БД."""
-        fields = [i.name for i in self.dataclass_fields]
+        """Десериализация объекта из БД (строка в порядке self.columns)."""
         kwargs = {"id": row[0]}
-        for field, val in zip(fields, row[1:]):
-            kwargs[field] = pickle.loads(bytes.fromhex(val))
+        for field, val in zip(self.dataclass_fields, row[1:]):
+            kwargs[field.name] = self.codecs[field.name].decode(val)
         return self.item_type(**kwargs)
 
     def _normalize_index(self, index: int) -> int:
-        """Нормализация отрицательных индексов."""
+        """
+        Нормализация отрицательных индексов. Положительный индекс — это id: после
+        удаления строк id идут с пропусками, поэтому с длиной таблицы он не сравнивается.
+        """
         if index < 0:
             index = len(self) + index
-        if index < 0 or index > len(self):
-            raise IndexError("list index out of range")
+            if index < 0:
+                raise IndexError("list index out of range")
         return index
 
     def append(self, item: T) -> int:
         """Добавление элемента в конец."""
         columns, values = self._serialize(item)
-        self.cursor.execute(
-            f"INSERT INTO {self.table_name} ({", ".join(columns)}) VALUES ({", ".join(["?"] * len(columns))})",
-            values
-        )
-        item_id = self.cursor.lastrowid
-        self.conn.commit()
+        with self.transaction():
+            self.cursor.execute(
+                f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                values
+            )
+            item_id = self.cursor.lastrowid
         return item_id
 
     def extend(self, iterable) -> None:
         """Расширение списка элементами из итерируемого объекта."""
-        for item in iterable:
-            self.append(item)
+        with self.transaction():
+            for item in iterable:
+                self.append(item)
 
     def insert(self, index: int, item: Game) -> None:
         """Вставка элемента по индексу."""
@@ -124,33 +505,34 @@ class Database(Generic[T]):
             return
 
         # Получаем id элемента на позиции index
-        self.cursor.execute(
+        rows = self._read(
             f"SELECT id FROM {self.table_name} ORDER BY id LIMIT 1 OFFSET ?",
             (index,)
         )
-        row = self.cursor.fetchone()
+        row = rows[0] if rows else None
 
         if row:
             target_id = row[0]
-            # Сдвигаем id всех элементов начиная с target_id
-            self.cursor.execute(
-                f"UPDATE {self.table_name} SET id = -id WHERE id >= ?",
-                (target_id,)
-            )
-            self.cursor.execute(
-                f"UPDATE {self.table_name} SET id = -id - 1 WHERE id < 0"
-            )
-            self.cursor.execute(
-                f"UPDATE {self.table_name} SET id = -id WHERE id < 0"
-            )
-
-            # Вставляем новый элемент
             columns, values = self._serialize(item)
-            self.cursor.execute(
-                f"INSERT INTO {self.table_name} ({", ".join(columns)}) VALUES ({", ".join(["?"] * len(columns))})",
-                values
-            )
-            self.conn.commit()
+            with self.transaction():
+                # Сдвигаем id всех элементов начиная с target_id
+                self.cursor.execute(
+                    f"UPDATE {self.table_name} SET id = -id WHERE id >= ?",
+                    (target_id,)
+                )
+                self.cursor.execute(
+                    f"UPDATE {self.table_name} SET id = -id - 1 WHERE id < 0"
+                )
+                self.cursor.execute(
+                    f"UPDATE {self.table_name} SET id = -id WHERE id < 0"
+                )
+                self._invalidate()
+
+                # Вставляем новый элемент
+                self.cursor.execute(
+                    f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                    values
+                )
 
     def remove(self, item: Game) -> None:
         """Удаление первого вхождения элемента."""
@@ -172,8 +554,9 @@ class Database(Generic[T]):
 
     def clear(self) -> None:
         """Очистка всех элементов."""
-        self.cursor.execute(f"DELETE FROM {self.table_name}")
-        self.conn.commit()
+        with self.transaction():
+            self.cursor.execute(f"DELETE FROM {self.table_name}")
+            self._invalidate()
 
     def index(self, item: Game, start: int = 0, stop: Optional[int] = None) -> int | None:
         """Поиск индекса первого вхождения элемента."""
@@ -183,28 +566,119 @@ class Database(Generic[T]):
                 return i
         return None
 
-    def get_by(self, key, value) -> list[T]:
-        """Получение элементов по ключу и значению."""
-        # Получаем список столбцов из метаданных таблицы
-        self.cursor.execute(f"PRAGMA table_info({self.table_name})")
-        columns = [row[1] for row in self.cursor.fetchall()]
+    def _expression(self, name: str) -> str:
+        """SQL-выражение для столбца или именованного индекса из одного выражения."""
+        if name == "id" or name in self.codecs:
+            return name
+        if name in self.indexes and len(self.indexes[name]) == 1:
+            return self.indexes[name][0]
+        raise ValueError(f"Столбец '{name}' не существует в таблице {self.table_name}")
 
-        if key not in columns:
-            raise ValueError(f"Столбец '{key}' не существует в таблице {self.table_name}")
+    def _encode(self, name: str, value):
+        return self.codecs[name].encode(value) if name in self.codecs else value
 
-        result = []
-        # self.conn.set_trace_callback(print)
-        # print(pickle.dumps(value).hex())
+    def _where(self, where: Union[dict, list[dict], None]) -> tuple[str, list]:
+        """
+        Построение WHERE. Ключ словаря — "столбец" или "столбец оператор" (см. QUERY_OPERATORS),
+        условия словаря объединяются через AND, а список словарей — через OR.
+        """
+        if not where:
+            return "", []
+        groups = where if isinstance(where, list) else [where]
+        group_sql = []
+        params = []
+        for group in groups:
+            conditions = []
+            for key, value in group.items():
+                name, _, operator = key.partition(" ")
+                operator = operator.strip().lower() or "="
+                if operator not in QUERY_OPERATORS:
+                    raise ValueError(f"Неизвестный оператор '{operator}'")
+                expression = self._expression(name)
+                if operator == "in":
+                    values = [self._encode(name, i) for i in value]
+                    conditions.append(f"{expression} IN ({', '.join(['?'] * len(values))})")
+                    params.extend(values)
+                elif value is None and operator in ("=", "!="):
+                    conditions.append(f"{expression} IS {'NOT ' if operator == '!=' else ''}NULL")
+                else:
+                    conditions.append(f"{expression} {operator} ?")
+                    params.append(self._encode(name, value))
+            group_sql.append("(" + " AND ".join(conditions) + ")")
+        return " WHERE " + " OR ".join(group_sql), params
+
+    def _order_by(self, order_by: Union[str, list[str], None]) -> str:
+        if not order_by:
+            return ""
+        terms = []
+        for term in [order_by] if isinstance(order_by, str) else order_by:
+            name, _, direction = term.partition(" ")
+            direction = direction.strip().upper()
+            if direction not in ("", "ASC", "DESC"):
+                raise ValueError(f"Неизвестное направление сортировки '{direction}'")
+            terms.append(f"{self._expression(name)} {direction}".rstrip())
+        return " ORDER BY " + ", ".join(terms)
+
+    def query(self, where: Union[dict, list[dict], None] = None, order_by: Union[str, list[str], None] = "id",
+              limit: Optional[int] = None, offset: Optional[int] = None,
+              columns: Optional[list[str]] = None) -> Union[list[T], list[dict]]:
+        """
+        Выборка элементов средствами SQL.
 
-        # Безопасно вставляем имя столбца после валидации
-        self.cursor.execute(
-            f"SELECT * FROM {self.table_name} WHERE {key} = ?",
-            (pickle.dumps(value).hex(),)
-        )
-        rows = self.cursor.fetchall()
-        if rows:
-            result = [self._deserialize(row) for row in rows]
-        return result
+        Args:
+            where: Условия отбора, например {"status": WAITING} или {"id <": 100}
+            order_by: Сортировка, например "id DESC"
+            limit: Максимальное количество строк
+            offset: Сколько строк пропустить
+            columns: Проекция; если задана, возвращаются словари только с этими полями
+
+        Returns:
+            Список объектов item_type или словарей при заданных columns
+        """
+        if columns is not None:
+            select = ", ".join(self._expression(column) for column in columns)
+        else:
+            select = self.columns
+        where_sql, params = self._where(where)
+        sql = f"SELECT {select} FROM {self.table_name}{where_sql}{self._order_by(order_by)}"
+        if limit is not None or offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset or 0]
+
+        rows = self._read(sql, params)
+        if columns is None:
+            return [self._deserialize(row) for row in rows]
+        return [
+            {column: self.codecs[column].decode(val) if column in self.codecs else val
+             for column, val in zip(columns, row)}
+            for row in rows
+        ]
+
+    def update(self, where: Union[dict, list[dict]], values: dict) -> int:
+        """
+        Условное обновление полей средствами SQL (UPDATE ... SET ... WHERE).
+
+        Args:
+            where: Условия отбора, как в query, например {"id": 1, "status": WAITING}
+            values: Новые значения полей
+
+        Returns:
+            Количество обновленных строк: 0, если условие уже не выполняется
+        """
+        where_sql, params = self._where(where)
+        assignments = ", ".join(f"{self._expression(name)} = ?" for name in values)
+        with self.transaction():
+            self.cursor.execute(
+                f"UPDATE {self.table_name} SET {assignments}{where_sql}",
+                [self._encode(name, value) for name, value in values.items()] + params
+            )
+            updated = self.cursor.rowcount
+            self._invalidate(where.get("id") if isinstance(where, dict) else None)
+        return updated
+
+    def get_by(self, key, value) -> list[T]:
+        """Получение элементов по ключу и значению."""
+        return self.query({key: value})
 
     def count(self, item: Game) -> int:
         """Подсчет количества вхождений элемента."""
@@ -213,17 +687,19 @@ class Database(Generic[T]):
     def reverse(self) -> None:
         """Разворот списка на месте."""
         items = list(self)
-        self.clear()
-        for item in reversed(items):
-            self.append(item)
+        with self.transaction():
+            self.clear()
+            for item in reversed(items):
+                self.append(item)
 
     def sort(self, *, key=None, reverse: bool = False) -> None:
         """Сортировка списка на месте."""
         items = list(self)
         items.sort(key=key, reverse=reverse)
-        self.clear()
-        for item in items:
-            self.append(item)
+        with self.transaction():
+            self.clear()
+            for item in items:
+                self.append(item)
 
     def copy(self) -> list:
         """Создание поверхностной копии в виде обычного списка."""
@@ -231,34 +707,41 @@ class Database(Generic[T]):
 
     def __len__(self) -> int:
         """Получение длины."""
-        self.cursor.execute(f"SELECT COUNT(*) FROM {self.table_name}")
-        return self.cursor.fetchone()[0]
+        return self._read(f"SELECT COUNT(*) FROM {self.table_name}")[0][0]
 
     def __getitem__(self, key: Union[int, slice]) -> T:
         """Получение элемента по индексу или срезу."""
         if isinstance(key, slice):
             # Обработка среза
             start, stop, step = key.indices(len(self))
-            result = []
-            for i in range(start, stop, step):
-                self.cursor.execute(
-                    f"SELECT * FROM {self.table_name} WHERE id = ?",
-                    (i,)
-                )
-                row = self.cursor.fetchone()
-                if row:
-                    result.append(self._deserialize(row))
-            return result
+            ids = range(start, stop, step)
+            if not ids:
+                return []
+            # Один запрос по диапазону id вместо запроса на каждый индекс; шаг отбирается
+            # в SQL, чтобы читались и десериализовались только возвращаемые строки
+            rows = self._read(
+                f"SELECT {self.columns} FROM {self.table_name} WHERE id BETWEEN ? AND ? AND (id - ?) % ? = 0 "
+                f"ORDER BY id {'DESC' if step < 0 else 'ASC'}",
+                (min(ids), max(ids), start, abs(step))
+            )
+            return [self._deserialize(row) for row in rows]
         elif isinstance(key, int):
-            # Обработка индекса
+            # Обработка индекса. Кэш отдает копии, чтобы изменения вызывающего не попали в него
+            if self.cache is not None and key >= 0:
+                item = self.cache.get(key)
+                if item is not None:
+                    return copy.deepcopy(item)
             index = self._normalize_index(key)
-            self.cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE id = ?",
+            version = self._cache_version
+            rows = self._read(
+                f"SELECT {self.columns} FROM {self.table_name} WHERE id = ?",
                 (index,)
             )
-            row = self.cursor.fetchone()
-            if row:
-                return self._deserialize(row)
+            if rows:
+                item = self._deserialize(rows[0])
+                if self.cache is not None:
+                    self._cache_put(index, item, version)
+                return item
             return None
         else:
             return None
@@ -292,20 +775,11 @@ class Database(Generic[T]):
             # Обработка индекса
             index = self._normalize_index(key)
 
-            # Получаем id элемента
-            self.cursor.execute(
-                f"SELECT id FROM {self.table_name} WHERE id = ?",
-                (index,)
-            )
-            row = self.cursor.fetchone()
-
-            if row:
-                columns, values = self._serialize(value)
-                cmd = f"UPDATE {self.table_name} SET {", ".join([col + ' = ?' for col in columns])} WHERE id = ?"
-                self.cursor.execute(cmd,
-                                    values + [row[0]]
-                                    )
-                self.conn.commit()
+            columns, values = self._serialize(value)
+            cmd = f"UPDATE {self.table_name} SET {', '.join([col + ' = ?' for col in columns])} WHERE id = ?"
+            with self.transaction():
+                self.cursor.execute(cmd, values + [index])
+                self._invalidate(index)
 
     def __delitem__(self, key: Union[int, slice]) -> None:
         """Удаление элемента по индексу или срезу."""
@@ -321,19 +795,12 @@ class Database(Generic[T]):
             # Обработка индекса
             index = self._normalize_index(key)
 
-            # Получаем id элемента
-            self.cursor.execute(
-                f"SELECT id FROM {self.table_name} WHERE id = ?",
-                (index,)
-            )
-            row = self.cursor.fetchone()
-
-            if row:
+            with self.transaction():
                 self.cursor.execute(
                     f"DELETE FROM {self.table_name} WHERE id = ?",
-                    (row[0],)
+                    (index,)
                 )
-                self.conn.commit()
+                self._invalidate(index)
 
     def __contains__(self, item: Game) -> bool:
         """Проверка наличия элемента."""
@@ -342,17 +809,33 @@ class Database(Generic[T]):
                 return True
         return False
 
+    def scan(self, where: Optional[dict] = None, descending: bool = False,
+             batch_size: Optional[int] = None) -> Iterator[T]:
+        """
+        Потоковый обход элементов пачками по batch_size строк.
+        Каждая пачка — отдельный запрос с курсором по id, поэтому память ограничена
+        размером пачки, а общий курсор не удерживается между пачками.
+        """
+        batch_size = batch_size or self.batch_size
+        operator = "id <" if descending else "id >"
+        last_id = None
+        while True:
+            conditions = dict(where or {})
+            if last_id is not None:
+                conditions[operator] = last_id
+            batch = self.query(conditions, order_by="id DESC" if descending else "id", limit=batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1].id
+
     def __iter__(self) -> Iterator[Game]:
         """Итератор по элементам."""
-        self.cursor.execute(f"SELECT * FROM {self.table_name} ORDER BY id")
-        for row in self.cursor.fetchall():
-            yield self._deserialize(row)
+        return self.scan()
 
     def __reversed__(self) -> Iterator[Game]:
         """Обратный итератор."""
-        self.cursor.execute(f"SELECT * FROM {self.table_name} ORDER BY id DESC")
-        for row in self.cursor.fetchall():
-            yield self._deserialize(row)
+        return self.scan(descending=True)
 
     def __add__(self, other) -> list:
         """Конкатенация с другим итерируемым объектом."""
@@ -392,7 +875,8 @@ class Database(Generic[T]):
 
     def close(self) -> None:
         """Закрытие соединения с БД."""
-        self.conn.close()
+        self.flush()
+        self.pool.close()
 
     def __enter__(self):
         """Вход в контекстный менеджер."""
@@ -403,6 +887,102 @@ class Database(Generic[T]):
         self.close()
 
 
+class WriteBehindStore(Generic[T]):
+    """
+    Реестр горячих объектов в памяти поверх Database с отложенной записью.
+    Изменения помечают объект «грязным»; грязные объекты записываются одной
+    транзакцией по истечении окна flush_interval, при явном flush() или finish().
+    Объекты, которых нет в памяти, читаются напрямую из БД.
+
+    start_background_task и sleep — функции сервера (socketio.start_background_task,
+    socketio.sleep): под eventlet отложенная запись идет гринлетом и снимает копии объектов
+    между обработчиками событий, а не посреди изменения. По умолчанию — поток и time.sleep.
+    """
+
+    def __init__(self, database: Database[T], flush_interval: float = 1.0,
+                 start_background_task=None, sleep=None):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.start_background_task = start_background_task or start_thread
+        self.sleep = sleep or time.sleep
+        self.items: dict[int, T] = {}
+        self._dirty: set[int] = set()
+        self._lock = threading.RLock()
+        # Порядок записей в БД; изменения в памяти его не ждут
+        self._write_lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def load(self, where: Optional[dict] = None) -> list[T]:
+        """Загрузка объектов из БД в память (восстановление после перезапуска)."""
+        loaded = list(self.database.scan(where))
+        with self._lock:
+            for item in loaded:
+                self.items[item.id] = item
+        return loaded
+
+    def __getitem__(self, key: int) -> T:
+        item = self.items.get(key)
+        if item is None:
+            return self.database[key]
+        return item
+
+    def __setitem__(self, key: int, value: T) -> None:
+        with self._lock:
+            self.items[key] = value
+            self._dirty.add(key)
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self.start_background_task(self._flush_later)
+
+    def _flush_later(self) -> None:
+        self.sleep(self.flush_interval)
+        try:
+            self.flush()
+        except Exception:
+            traceback.print_exc()
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.items
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(list(self.items.values()))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def flush(self) -> None:
+        """Запись всех грязных объектов в БД одной транзакцией."""
+        with self._write_lock:
+            with self._lock:
+                self._flush_scheduled = False
+                snapshot = [(key, copy.deepcopy(self.items[key])) for key in self._dirty]
+                self._dirty = set()
+            if not snapshot:
+                return
+            with self.database.transaction():
+                for key, item in snapshot:
+                    self.database[key] = item
+
+    def keep(self, key: int, value: T) -> None:
+        """Кладет в память объект, совпадающий с БД, не помечая его грязным."""
+        with self._lock:
+            self.items[key] = value
+
+    def evict(self, key: int) -> None:
+        """Убирает объект из памяти без записи в БД (им теперь владеет другой процесс)."""
+        with self._lock:
+            self.items.pop(key, None)
+            self._dirty.discard(key)
+
+    def finish(self, key: int, value: T) -> None:
+        """Синхронная запись объекта и удаление его из памяти (например, по окончании игры)."""
+        with self._write_lock:
+            self.database[key] = value
+            with self._lock:
+                self.items.pop(key, None)
+                self._dirty.discard(key)
+
+
 if __name__ == "__main__":
     db = Database(Game)
     id_ = db.append(
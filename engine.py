@@ -0,0 +1,247 @@
+"""
+Движок игры на битовых масках.
+
+Доска — 9 мини-досок, у каждой по 9-битной маске для X и для O.
+Ход кодируется числом 9 * mini + cell, где mini — номер мини-доски (0..8),
+а cell — номер клетки внутри нее (0..8), оба в порядке слева направо, сверху вниз.
+Позиция идентифицируется 64-битным хешем Zobrist, который обновляется за O(1) на ход.
+"""
+import random
+import re
+
+FULL = 0b111111111
+
+START_FEN = "04" + "0" * 81
+FEN_PATTERN = re.compile(r"[01][0-8][012]{81}")
+
+# Линии мини-доски: три ряда, три столбца и две диагонали
+LINES = tuple(
+    (1 << a) | (1 << b) | (1 << c)
+    for a, b, c in [(0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6)]
+)
+
+# WINS[mask] — есть ли в маске мини-доски целая линия
+WINS = bytes(any(mask & line == line for line in LINES) for mask in range(1 << 9))
+
+# EMPTY_CELLS[occupied] — свободные клетки мини-доски по маске занятых
+EMPTY_CELLS = tuple(tuple(cell for cell in range(9) if not occupied >> cell & 1) for occupied in range(1 << 9))
+
+# Троичный код мини-доски: сумма 3 ** cell * (1 за X, 2 за O) по клеткам, всего 3 ** 9 состояний.
+# TERNARY[mask] — вклад маски одной стороны, так что код = TERNARY[x] + 2 * TERNARY[o]
+MINI_STATES = 3 ** 9
+TERNARY = tuple(sum(3 ** cell for cell in range(9) if mask >> cell & 1) for mask in range(1 << 9))
+
+# Исходы мини-доски в OUTCOME
+ONGOING, X_LINE, O_LINE, DRAWN = 0, 1, 2, 3
+
+
+def _mini_tables():
+    """
+    Таблицы по троичному коду мини-доски: исход и число открытых двоек X и O
+    (линий с двумя своими метками и свободной третьей клеткой).
+    Перебираются только допустимые пары масок, то есть ровно 3 ** 9 состояний.
+    """
+    two_lines = [0] * (1 << 9)  # Линии, где у маски ровно две метки
+    touched = [0] * (1 << 9)  # Линии, задетые маской
+    for mask in range(1 << 9):
+        for i, line in enumerate(LINES):
+            if mask & line:
+                touched[mask] |= 1 << i
+            if bin(mask & line).count("1") == 2:
+                two_lines[mask] |= 1 << i
+    popcount = bytes(bin(lines).count("1") for lines in range(1 << len(LINES)))
+
+    outcome, x_twos, o_twos = bytearray(MINI_STATES), bytearray(MINI_STATES), bytearray(MINI_STATES)
+    for x in range(1 << 9):
+        free = FULL & ~x
+        o = free
+        while True:
+            code = TERNARY[x] + 2 * TERNARY[o]
+            outcome[code] = X_LINE if WINS[x] else O_LINE if WINS[o] else DRAWN if x | o == FULL else ONGOING
+            x_twos[code] = popcount[two_lines[x] & ~touched[o]]
+            o_twos[code] = popcount[two_lines[o] & ~touched[x]]
+            if not o:
+                break
+            o = (o - 1) & free
+    return bytes(outcome), bytes(x_twos), bytes(o_twos)
+
+
+OUTCOME, X_TWOS, O_TWOS = _mini_tables()
+
+
+def mini_code(x: int, o: int) -> int:
+    return TERNARY[x] + 2 * TERNARY[o]
+
+
+# Перевод между (row, col) на доске 9x9 и номером хода
+MOVE_INDEX = tuple(
+    tuple(9 * (3 * (row // 3) + col // 3) + 3 * (row % 3) + col % 3 for col in range(9))
+    for row in range(9)
+)
+MOVE_ROW_COL = tuple(
+    (3 * (move // 9 // 3) + move % 9 // 3, 3 * (move // 9 % 3) + move % 9 % 3)
+    for move in range(81)
+)
+
+# Тройка клеток одного ряда мини-доски по 3-битным маскам X и O
+_TRIPLES = tuple(
+    tuple("".join("1" if x >> i & 1 else "2" if o >> i & 1 else "0" for i in range(3)) for o in range(8))
+    for x in range(8)
+)
+
+
+# Ключи Zobrist. Seed фиксирован, чтобы хеши совпадали во всех процессах
+_zobrist_random = random.Random(0x7A3)
+X_KEYS = tuple(_zobrist_random.getrandbits(64) for _ in range(81))
+O_KEYS = tuple(_zobrist_random.getrandbits(64) for _ in range(81))
+ACTIVE_KEYS = tuple(_zobrist_random.getrandbits(64) for _ in range(9))
+SIDE_KEY = _zobrist_random.getrandbits(64)
+
+
+def _mini_hashes(keys, mini):
+    """Хеш всех меток одной мини-доски по ее маске."""
+    hashes = [0] * (1 << 9)
+    for mask in range(1, 1 << 9):
+        low = mask & -mask
+        hashes[mask] = hashes[mask ^ low] ^ keys[9 * mini + low.bit_length() - 1]
+    return tuple(hashes)
+
+
+MINI_X_HASH = tuple(_mini_hashes(X_KEYS, mini) for mini in range(9))
+MINI_O_HASH = tuple(_mini_hashes(O_KEYS, mini) for mini in range(9))
+
+
+class Board:
+    """Позиция: маски X и O по мини-доскам, сторона хода, активная мини-доска и хеш."""
+    __slots__ = ("x", "o", "step", "active", "hash", "history")
+
+    def __init__(self):
+        self.x = [0] * 9
+        self.o = [0] * 9
+        self.step = 0
+        self.active = 4
+        self.hash = ACTIVE_KEYS[4]
+        # Стек для undo: (mini, маска X, маска O, активная мини-доска, хеш) до хода
+        self.history = []
+
+    def compute_hash(self) -> int:
+        """Хеш позиции с нуля (в обычной работе поддерживается инкрементально)."""
+        value = ACTIVE_KEYS[self.active] ^ (SIDE_KEY if self.step else 0)
+        for mini in range(9):
+            value ^= MINI_X_HASH[mini][self.x[mini]] ^ MINI_O_HASH[mini][self.o[mini]]
+        return value
+
+    @classmethod
+    def from_fen(cls, fen: str) -> "Board":
+        board = cls()
+        board.step = int(fen[0])
+        board.active = int(fen[1])
+        x, o = board.x, board.o
+        for move in range(81):
+            row, col = MOVE_ROW_COL[move]
+            mark = fen[9 * row + col + 2]
+            if mark == "1":
+                x[move // 9] |= 1 << move % 9
+            elif mark == "2":
+                o[move // 9] |= 1 << move % 9
+        board.hash = board.compute_hash()
+        return board
+
+    def to_fen(self) -> str:
+        x, o = self.x, self.o
+        parts = [str(self.step), str(self.active)]
+        for row in range(9):
+            shift = 3 * (row % 3)
+            for mini in range(3 * (row // 3), 3 * (row // 3) + 3):
+                parts.append(_TRIPLES[x[mini] >> shift & 7][o[mini] >> shift & 7])
+        return "".join(parts)
+
+    def copy(self) -> "Board":
+        board = Board()
+        board.x = self.x[:]
+        board.o = self.o[:]
+        board.step = self.step
+        board.active = self.active
+        board.hash = self.hash
+        return board
+
+    def mark_at(self, move: int):
+        """'X', 'O' или None для клетки."""
+        bit = 1 << move % 9
+        if self.x[move // 9] & bit:
+            return "X"
+        if self.o[move // 9] & bit:
+            return "O"
+        return None
+
+    def is_legal(self, move: int) -> bool:
+        mini = move // 9
+        return mini == self.active and not (self.x[mini] | self.o[mini]) >> move % 9 & 1
+
+    def is_won(self) -> bool:
+        """Собрана ли линия хотя бы в одной мини-доске (партия окончена)."""
+        return any(OUTCOME[TERNARY[x] + 2 * TERNARY[o]] in (X_LINE, O_LINE) for x, o in zip(self.x, self.o))
+
+    def legal_moves(self) -> list[int]:
+        mini = self.active
+        base = 9 * mini
+        return [base + cell for cell in EMPTY_CELLS[self.x[mini] | self.o[mini]]]
+
+    def apply(self, move: int) -> bool:
+        """
+        Ход стороны self.step без проверки легальности.
+        Возвращает True, если ход собрал линию (партия выиграна).
+        Заполненная без линии мини-доска очищается.
+        """
+        mini, cell = divmod(move, 9)
+        self.history.append((mini, self.x[mini], self.o[mini], self.active, self.hash))
+        if self.step:
+            masks, keys = self.o, O_KEYS
+        else:
+            masks, keys = self.x, X_KEYS
+        masks[mini] |= 1 << cell
+        value = self.hash ^ keys[move] ^ ACTIVE_KEYS[self.active] ^ ACTIVE_KEYS[cell] ^ SIDE_KEY
+        # Линию может собрать только сходившая сторона, так что X_LINE/O_LINE — победа
+        outcome = OUTCOME[TERNARY[self.x[mini]] + 2 * TERNARY[self.o[mini]]]
+        wins = outcome == X_LINE or outcome == O_LINE
+        if outcome == DRAWN:
+            value ^= MINI_X_HASH[mini][self.x[mini]] ^ MINI_O_HASH[mini][self.o[mini]]
+            self.x[mini] = self.o[mini] = 0
+        self.hash = value
+        self.active = cell
+        self.step ^= 1
+        return wins
+
+    def undo(self) -> None:
+        mini, self.x[mini], self.o[mini], self.active, self.hash = self.history.pop()
+        self.step ^= 1
+
+
+def is_fen(fen) -> bool:
+    """
+    Строка — fen достижимой позиции. Заполненная без линии мини-доска очищается ходом,
+    который ее заполнил, поэтому такой позиции (в том числе без ходов в активной
+    мини-доске) в партии не бывает.
+    """
+    if not isinstance(fen, str) or FEN_PATTERN.fullmatch(fen) is None:
+        return False
+    board = Board.from_fen(fen)
+    return all(OUTCOME[TERNARY[x] + 2 * TERNARY[o]] != DRAWN for x, o in zip(board.x, board.o))
+
+
+def replay(pgn: str, fen: str = START_FEN) -> list[str]:
+    """
+    fen до первого хода и после каждого хода pgn.
+    Ход в pgn — номер клетки внутри активной мини-доски; ValueError, если ход нелегален
+    или сделан после победы.
+    """
+    board = Board.from_fen(fen)
+    fens = [fen]
+    won = False
+    for ply, char in enumerate(pgn):
+        move = 9 * board.active + int(char)
+        if won or not board.is_legal(move):
+            raise ValueError(f"illegal move {ply + 1}")
+        won = board.apply(move)
+        fens.append(board.to_fen())
+    return fens
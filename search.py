@@ -0,0 +1,318 @@
+"""
+Поиск хода для бота: итеративное углубление с альфа-бета отсечением и таблицей
+транспозиций, а также MCTS (UCT со случайными доигрываниями).
+
+Функции модуля не трогают состояние сервера, поэтому best_move можно
+вызывать в отдельном процессе (см. bot_pool в app.py). Таблица транспозиций
+TABLE общая для всех поисков в процессе и переживает отдельные запросы.
+"""
+import math
+import random
+import time
+from typing import Optional
+
+from engine import Board, TERNARY, X_TWOS, O_TWOS
+
+WIN_SCORE = 1_000_000
+INFINITY = 10 * WIN_SCORE
+
+# Флаги записей таблицы транспозиций
+EXACT, LOWER, UPPER = 0, 1, 2
+
+SEARCH_MODES = ("alphabeta", "mcts")
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable:
+    """
+    Таблица транспозиций фиксированного размера с адресацией по младшим битам хеша Zobrist.
+    Запись замещается, если слот пуст, ключ совпадает, запись осталась от прошлого поиска
+    или новая запись не менее глубокая.
+    """
+
+    def __init__(self, bits: int = 18):
+        self.mask = (1 << bits) - 1
+        self.keys: list[Optional[int]] = [None] * (1 << bits)
+        # (depth, score, flag, move, generation)
+        self.entries: list[Optional[tuple]] = [None] * (1 << bits)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def new_search(self) -> None:
+        """Начало нового поиска: записи прошлых поисков становятся кандидатами на замещение."""
+        self.generation += 1
+
+    def get(self, key: int) -> Optional[tuple]:
+        """(depth, score, flag, move) или None."""
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.entries[index][:4]
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, score: int, flag: int, move: int) -> None:
+        index = key & self.mask
+        old = self.entries[index]
+        if old is None or self.keys[index] == key or old[4] != self.generation or depth >= old[0]:
+            self.keys[index] = key
+            self.entries[index] = (depth, score, flag, move, self.generation)
+
+    def __len__(self) -> int:
+        return sum(1 for key in self.keys if key is not None)
+
+
+TABLE = TranspositionTable()
+
+
+def evaluate(board: Board) -> int:
+    """
+    Оценка позиции с точки зрения стороны, чья очередь хода: разность открытых двоек
+    (см. engine.X_TWOS) по всем мини-доскам.
+    """
+    x, o = board.x, board.o
+    twos = O_TWOS if board.step else X_TWOS
+    if twos[TERNARY[x[board.active]] + 2 * TERNARY[o[board.active]]]:
+        # Линию в активной мини-доске можно закрыть прямо сейчас
+        return WIN_SCORE - 1
+    score = 0
+    for mini in range(9):
+        code = TERNARY[x[mini]] + 2 * TERNARY[o[mini]]
+        score += X_TWOS[code] - O_TWOS[code]
+    return -score if board.step else score
+
+
+class AlphaBeta:
+    """Итеративное углубление с negamax, альфа-бета отсечением и таблицей транспозиций."""
+
+    def __init__(self, deadline: float, table: TranspositionTable = None):
+        self.deadline = deadline
+        self.table = table if table is not None else TABLE
+        self.nodes = 0
+        # Хеши позиций на текущем пути: повтор позиции считается ничьей
+        self.path: set[int] = set()
+
+    def negamax(self, board: Board, depth: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout
+
+        key = board.hash
+        if key in self.path:
+            return 0
+        entry = self.table.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, tt_move = entry
+            if entry_depth >= depth:
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if entry_flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        if depth == 0:
+            return evaluate(board)
+
+        moves = board.legal_moves()
+        if not moves:
+            # Ходить некуда: в достижимых позициях не бывает (см. engine.is_fen), считаем ничьей
+            return 0
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, moves[0]
+        self.path.add(key)
+        for move in moves:
+            if board.apply(move):
+                # Быстрая победа лучше долгой
+                score = WIN_SCORE + depth
+            else:
+                score = -self.negamax(board, depth - 1, -beta, -alpha)
+            board.undo()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        self.path.discard(key)
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, best_score, flag, best_move)
+        return best_score
+
+    def search(self, board: Board, max_depth: int) -> dict:
+        terminal = terminal_result(board, -WIN_SCORE, 0)
+        if terminal is not None:
+            return dict(terminal, depth=0)
+        result = {"move": board.legal_moves()[0], "score": 0, "depth": 0}
+        self.table.new_search()
+        history = len(board.history)
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(board, depth, -INFINITY, INFINITY)
+            except SearchTimeout:
+                # Откатываем ходы, сделанные прерванной итерацией
+                while len(board.history) > history:
+                    board.undo()
+                self.path.clear()
+                break
+            entry = self.table.get(board.hash)
+            if entry is not None:
+                result = {"move": entry[3], "score": score, "depth": depth}
+            if abs(score) >= WIN_SCORE:
+                break
+        result["nodes"] = self.nodes
+        return result
+
+
+def terminal_result(board: Board, lost, drawn) -> Optional[dict]:
+    """
+    Результат поиска для позиции без ходов с move None: score lost, если партия уже
+    выиграна (проиграла сторона хода), и drawn, если ходить некуда. None — позиция не конечная.
+    """
+    if board.is_won():
+        return {"move": None, "score": lost, "nodes": 0}
+    if not board.legal_moves():
+        return {"move": None, "score": drawn, "nodes": 0}
+    return None
+
+
+class MCTSNode:
+    __slots__ = ("move", "parent", "children", "untried", "visits", "wins")
+
+    def __init__(self, board: Board, move=None, parent=None):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = board.legal_moves()
+        self.visits = 0
+        # Выигрыши стороны, сделавшей ход move
+        self.wins = 0.0
+
+    def select(self, exploration: float) -> "MCTSNode":
+        log_visits = math.log(self.visits)
+        return max(
+            self.children,
+            key=lambda child: child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits)
+        )
+
+
+def mcts(board: Board, deadline: float, max_nodes: int = None, exploration: float = 1.4,
+         playout_limit: int = 200, rng: random.Random = None) -> dict:
+    """
+    Monte Carlo Tree Search с UCT. Доигрывания случайные и ограничены playout_limit ходами;
+    недоигранная партия считается ничьей.
+    """
+    # score MCTS — доля выигрышей: 0 за проигранную позицию, 0.5 за ничью
+    terminal = terminal_result(board, 0.0, 0.5)
+    if terminal is not None:
+        return terminal
+    rng = rng or random.Random()
+    root = MCTSNode(board)
+    iterations = 0
+    while (max_nodes is None or iterations < max_nodes) and time.monotonic() < deadline:
+        iterations += 1
+        node = root
+        depth = 0
+        winner = None
+
+        # Выбор
+        while not node.untried and node.children:
+            node = node.select(exploration)
+            if board.apply(node.move):
+                winner = board.step ^ 1
+            depth += 1
+            if winner is not None:
+                break
+
+        # Расширение
+        if winner is None and node.untried:
+            move = node.untried.pop(rng.randrange(len(node.untried)))
+            if board.apply(move):
+                winner = board.step ^ 1
+            depth += 1
+            child = MCTSNode(board, move, node)
+            if winner is not None:
+                child.untried = []
+            node.children.append(child)
+            node = child
+
+        # Доигрывание
+        playout = 0
+        while winner is None and playout < playout_limit:
+            moves = board.legal_moves()
+            if not moves:
+                break
+            if board.apply(moves[rng.randrange(len(moves))]):
+                winner = board.step ^ 1
+            playout += 1
+        for _ in range(depth + playout):
+            board.undo()
+
+        # Обратное распространение; node.move сделан стороной, противоположной
+        # стороне хода в позиции узла
+        side = (board.step + depth + 1) % 2
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == side:
+                node.wins += 1
+            side ^= 1
+            node = node.parent
+
+    if not root.children:
+        return {"move": board.legal_moves()[0], "score": 0.5, "nodes": iterations}
+    best = max(root.children, key=lambda child: child.visits)
+    return {"move": best.move, "score": best.wins / best.visits, "nodes": iterations}
+
+
+def best_move(fen: str, mode: str = "alphabeta", time_limit: float = 1.0, max_depth: int = 64,
+              max_nodes: int = None) -> dict:
+    """
+    Лучший ход в позиции fen.
+
+    Args:
+        mode: "alphabeta" или "mcts"
+        time_limit: Бюджет времени в секундах
+        max_depth: Предельная глубина для alphabeta
+        max_nodes: Предельное число итераций для mcts
+
+    Returns:
+        {"move": номер хода (см. engine), "score": оценка, "nodes": ..., ...};
+        move None, если партия окончена или ходить некуда
+    """
+    board = Board.from_fen(fen)
+    deadline = time.monotonic() + time_limit
+    if mode == "mcts":
+        return mcts(board, deadline, max_nodes)
+    return AlphaBeta(deadline).search(board, max_depth)
+
+
+def analyse(fen: str, mode: str = "alphabeta", time_limit: float = 0.2, deadline: float = None) -> Optional[dict]:
+    """
+    Оценка позиции для страницы анализа, как best_move, но с общим для запроса дедлайном.
+    deadline — момент по time.time(): задача, дождавшаяся очереди после него, возвращает None.
+    В результате time_limit — фактический бюджет поиска с учетом дедлайна.
+    """
+    if deadline is not None:
+        time_limit = min(time_limit, deadline - time.time())
+        if time_limit <= 0:
+            return None
+    result = best_move(fen, mode, time_limit)
+    if result is not None:
+        result["time_limit"] = time_limit
+    return result
@@ -195,6 +195,7 @@ class Node {
         this.parent = parent;       // Родительский узел
         this.children = [];         // Массив дочерних узлов
         this.winner = null;         // Победитель после этого хода
+        this.evaluation = null;     // Оценка сервера: {move: [row, col], score, depth, nodes}
     }
 
     /**
@@ -336,6 +337,9 @@ class AnalysisManager {
         this.renderTree();
         this.goToLast();
         console.log("SUCCESS");
+
+        // Вся партия оценивается на сервере одним запросом
+        this.evaluateNodes([this.root, ...this.currentNode.getPath()]);
         
         return true;
     }
@@ -385,6 +389,9 @@ class AnalysisManager {
 
             childNode = this.currentNode.addChild(move, result.fen, mark);
             childNode.winner = result.winner;
+            if (!childNode.winner) {
+                this.evaluateNodes([childNode]);
+            }
         }
 
         // Переходим к узлу
@@ -508,9 +515,58 @@ class AnalysisManager {
             const state = this.logic.parseFen(this.currentNode.fen);
             const nextMark = state.step === 0 ? 'X' : 'O';
             statusEl.textContent = window.i18n.t('game.move', { mark: nextMark });
+            if (this.currentNode.evaluation) {
+                statusEl.textContent += ' · ' + this.formatEvaluation(this.currentNode);
+            }
         }
     }
 
+    /**
+     * Оценить позиции узлов на сервере (POST /api/analysis)
+     */
+    async evaluateNodes(nodes) {
+        nodes = nodes.filter(node => !node.winner && !node.evaluation);
+        if (nodes.length === 0) return;
+
+        try {
+            const response = await fetch('/api/analysis', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ fens: nodes.map(node => node.fen) })
+            });
+            if (!response.ok) return;
+            const data = await response.json();
+            data.positions.forEach((position, i) => {
+                if (position) nodes[i].evaluation = position;
+            });
+        } catch (err) {
+            console.error('Ошибка анализа позиций:', err);
+            return;
+        }
+        this.updateStatus();
+    }
+
+    /**
+     * Текст оценки узла: счет с точки зрения X и лучший ход
+     */
+    formatEvaluation(node) {
+        const state = this.logic.parseFen(node.fen);
+        const { score, move } = node.evaluation;
+        const xScore = state.step === 0 ? score : -score;
+        let scoreText;
+        if (Math.abs(xScore) >= 999999) {
+            scoreText = (xScore > 0 ? 'X' : 'O') + '#';
+        } else {
+            scoreText = (xScore > 0 ? '+' : '') + xScore;
+        }
+        // Позиция без ходов (партия окончена): только оценка
+        if (!move) return scoreText;
+        const [row, col] = move;
+        const cell = 3 * (row % 3) + (col % 3);
+        const mark = state.step === 0 ? 'X' : 'O';
+        return window.i18n.t('analysis.evaluation', { score: scoreText, move: `${mark}:${cell + 1}` });
+    }
+
     /**
      * Рендеринг дерева ходов
      */
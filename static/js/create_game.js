@@ -34,6 +34,7 @@ document.getElementById('createGameForm').addEventListener('submit', async funct
     const useTimer = document.getElementById('useTimer').checked;
     const useRandomStart = document.getElementById('randomStart').checked;
     const pieceSelection = document.querySelector('input[name="piece"]:checked').value;
+    const opponent = document.querySelector('input[name="opponent"]:checked').value;
 
     // Определяем, какую фигуру выбрал игрок
     let playerPiece = pieceSelection;
@@ -45,7 +46,8 @@ document.getElementById('createGameForm').addEventListener('submit', async funct
     const gameData = {
         player_piece: playerPiece,
         use_time: useTimer,
-        use_random_start: useRandomStart
+        use_random_start: useRandomStart,
+        bot: opponent || null
     };
 
     // Добавляем настройки времени только если таймер включен
@@ -26,7 +26,9 @@ document.addEventListener('DOMContentLoaded', () => {
     var last_timer = () => null;
     let movesHistoryManager = null;
 
-    const socket = io();
+    // game_id нужен балансировщику, чтобы направить соединение к воркеру-владельцу партии
+    const socket = io({query: {game_id: init.gameId}});
+    trackPresence(socket, init.gameId);
     window.GAME_SOCKET = socket; // Для удобства отладки в консоли
 
     let addTimeBtn = document.getElementById("addTimeBtn");
@@ -71,7 +73,7 @@ document.addEventListener('DOMContentLoaded', () => {
     });
     socket.on('connect_error', (error) => console.log('Connection error:', error));
 
-    socket.on('update_state', (state) => {
+    subscribeGameState(socket, init.gameId, (state) => {
         console.log('Received new game state:', state);
 
         // Сохраняем последнее состояние для навигатора
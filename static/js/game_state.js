@@ -0,0 +1,70 @@
+// game_state.js - Синхронизация состояния партии по дельтам (см. broadcast_delta в app.py)
+
+/**
+ * Новое состояние после дельты. Дельта содержит только изменения:
+ * move — [row, col] хода, cleared — очищена ли заполненная мини-доска,
+ * left_time/last_move_time — часы, status/winner — конец партии
+ */
+function applyDelta(state, delta) {
+    const next = Object.assign({}, state);
+
+    if (delta.move) {
+        const [row, col] = delta.move;
+        const cells = state.fen.slice(2).split('');
+        cells[9 * row + col] = state.step === 0 ? '1' : '2';
+
+        if (delta.cleared) {
+            const miniRow = Math.floor(row / 3) * 3;
+            const miniCol = Math.floor(col / 3) * 3;
+            for (let r = miniRow; r < miniRow + 3; r++) {
+                for (let c = miniCol; c < miniCol + 3; c++) {
+                    cells[9 * r + c] = '0';
+                }
+            }
+        }
+
+        // Следующий ход — в мини-доске с номером клетки текущего хода
+        const cellIndex = 3 * (row % 3) + (col % 3);
+        next.step = 1 - state.step;
+        next.active_mini = cellIndex;
+        next.pgn = state.pgn + cellIndex;
+        next.fen = `${next.step}${cellIndex}` + cells.join('');
+    }
+
+    for (const key of ['left_time', 'last_move_time', 'status', 'winner']) {
+        if (key in delta) next[key] = delta[key];
+    }
+    next.seq = delta.seq;
+    return next;
+}
+
+/**
+ * Подписка на полное состояние (update_state) и дельты (delta).
+ * При пропуске номера seq запрашивает у сервера полное состояние (resync).
+ * onState вызывается с актуальным полным состоянием после каждого изменения.
+ */
+function subscribeGameState(socket, gameId, onState) {
+    let state = null;
+    let resyncing = false;
+
+    socket.on('update_state', (fullState) => {
+        state = fullState;
+        resyncing = false;
+        onState(state);
+    });
+
+    socket.on('delta', (delta) => {
+        // До первого полного состояния дельты не к чему применять: оно придет в ответ на join
+        if (!state || resyncing || delta.seq <= state.seq) return;
+
+        if (delta.seq !== state.seq + 1) {
+            console.log(`Delta gap: have ${state.seq}, got ${delta.seq}; resync`);
+            resyncing = true;
+            socket.emit('resync', {game_id: gameId});
+            return;
+        }
+
+        state = applyDelta(state, delta);
+        onState(state);
+    });
+}
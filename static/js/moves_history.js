@@ -3,6 +3,7 @@ class MovesHistoryManager {
     constructor(board) {
         this.board = board;
         this.moves = [];
+        this.fens = [];  // Позиции партии с сервера: fens[i] — позиция до хода i
         this.currentMoveIndex = -1;
         this.isViewingHistory = false;
         this.gameId = window.INIT?.gameId;
@@ -48,14 +49,35 @@ class MovesHistoryManager {
         this.updateNavigationButtons();
     }
 
-    goToMove(index) {
+    async loadFens() {
+        // Сервер восстанавливает все позиции партии за один проход (с учетом случайной расстановки)
+        if (!this.gameId) return;
+        try {
+            const response = await fetch(`/api/games/${this.gameId}/positions`);
+            if (response.ok) {
+                this.fens = (await response.json()).fens;
+            }
+        } catch (err) {
+            console.error('Ошибка загрузки позиций партии:', err);
+        }
+    }
+
+    async goToMove(index) {
         if (index < 0 || index >= this.moves.length) return;
 
+        if (this.fens.length !== this.moves.length + 1) {
+            await this.loadFens();
+        }
+
         this.currentMoveIndex = index;
         this.isViewingHistory = index < this.moves.length - 1;
 
         // Восстанавливаем состояние доски до указанного хода
-        this.reconstructBoardState(index);
+        if (this.fens.length === this.moves.length + 1) {
+            this.showFen(index);
+        } else {
+            this.reconstructBoardState(index);
+        }
 
         // Обновляем UI
         this.updateViewingIndicator();
@@ -74,6 +96,24 @@ class MovesHistoryManager {
         }
     }
 
+    showFen(moveIndex) {
+        // Позиция после хода moveIndex
+        const fen = this.fens[moveIndex + 1];
+        this.board.clear();
+        for (let r = 0; r < 9; r++) {
+            for (let c = 0; c < 9; c++) {
+                const ch = fen[2 + r * 9 + c];
+                this.board.setMark(r, c, ch === '1' ? 'X' : ch === '2' ? 'O' : '');
+            }
+        }
+
+        const activeMini = parseInt(this.fens[moveIndex][1]);
+        const cellIndex = this.moves[moveIndex];
+        const globalRow = Math.floor(activeMini / 3) * 3 + Math.floor(cellIndex / 3);
+        const globalCol = (activeMini % 3) * 3 + cellIndex % 3;
+        this.board.highlightLast(globalRow, globalCol);
+    }
+
     reconstructBoardState(moveIndex) {
         // Очищаем доску
         this.board.clear();
@@ -0,0 +1,22 @@
+// presence.js - Heartbeat соединения и индикация присутствия игроков (см. PresenceTracker в utils.py)
+
+/**
+ * Отправляет heartbeat с интервалом, который сервер назначил роли соединения,
+ * и отмечает отключившихся игроков классом offline у их имен
+ */
+function trackPresence(socket, gameId) {
+    let heartbeat = null;
+
+    socket.on('heartbeat_interval', ({interval}) => {
+        clearInterval(heartbeat);
+        heartbeat = setInterval(() => socket.emit('heartbeat', {game_id: gameId}), interval * 1000);
+    });
+
+    socket.on('disconnect', () => clearInterval(heartbeat));
+
+    socket.on('presence', ({online}) => {
+        ['X', 'O'].forEach((mark, seat) => {
+            document.getElementById(`username${mark}`)?.classList.toggle('offline', !online[seat]);
+        });
+    });
+}
@@ -38,14 +38,16 @@ document.addEventListener('DOMContentLoaded', () => {
         board.setState(init.initialGrid);
     }
 
-    const socket = io();
+    // game_id нужен балансировщику, чтобы направить соединение к воркеру-владельцу партии
+    const socket = io({query: {game_id: gameId}});
+    trackPresence(socket, gameId);
 
     socket.on('connect', () => {
         console.log('Socket.IO connected as spectator. Joining game room:', gameId);
         socket.emit('join', { game_id: gameId });
     });
 
-    socket.on('update_state', (state) => {
+    subscribeGameState(socket, gameId, (state) => {
         console.log('Received new game state:', state);
 
         // Сохраняем последнее состояние для навигатора
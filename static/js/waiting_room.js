@@ -6,7 +6,8 @@ document.addEventListener('DOMContentLoaded', () => {
         return;
     }
 
-    const socket = io();
+    const socket = io({query: {game_id: gameId}});
+    trackPresence(socket, gameId);
 
     socket.on('connect', () => {
         console.log('Socket.IO connected! Joining waiting room for game:', gameId);
@@ -1,10 +1,17 @@
 import dataclasses
 import datetime
+import heapq
+import itertools
 import threading
 import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Optional, List
 
+import engine
+
 WAITING, ACTIVE, ENDED = "waiting", "active", "ended"
 
 
@@ -19,8 +26,24 @@ class Game:
     time_addition: int = 0
     use_time: bool = False
     last_move_time: Optional[datetime.datetime] = None
-    winner: Optional[str] = None
+    winner: Optional[int] = None
     fen: str = "04" + "0" * 81
+    bot: Optional[str] = None  # Режим поиска бота-соперника (см. search.SEARCH_MODES)
+    start_fen: Optional[str] = None  # Начальная позиция случайной расстановки; None — пустая доска
+    # Изменения состояния помимо ходов (добавка времени, конец партии); None в старых строках
+    events: Optional[int] = 0
+
+    @property
+    def seq(self) -> int:
+        """
+        Номер версии состояния для дельта-протокола: ходы плюс прочие изменения. Выводится
+        из сохраненного состояния, поэтому одинаков у любого воркера-владельца партии.
+        """
+        return len(self.pgn) + (self.events or 0)
+
+    def add_event(self):
+        """Учитывает изменение состояния без хода (см. seq)."""
+        self.events = (self.events or 0) + 1
 
     def add_step(self, step):
         self.pgn += str(step)
@@ -43,6 +66,35 @@ class Game:
 
     grid = property(__get_grid, __set_grid)
 
+    @property
+    def board(self) -> engine.Board:
+        """Битовое представление позиции; пересобирается из fen, только если fen изменился."""
+        cached = getattr(self, "_board", None)
+        if cached is None or cached[0] != self.fen:
+            cached = (self.fen, engine.Board.from_fen(self.fen))
+            self._board = cached
+        return cached[1]
+
+    def play(self, row, col) -> bool:
+        """Ход стороны, чья сейчас очередь. Возвращает True, если ход выиграл партию."""
+        board = self.board
+        wins = board.apply(engine.MOVE_INDEX[row][col])
+        self.add_step(3 * (row % 3) + (col % 3))
+        self.fen = board.to_fen()
+        self._board = (self.fen, board)
+        return wins
+
+    def positions(self) -> list[str]:
+        """
+        fen начальной позиции и позиции после каждого хода pgn.
+        ValueError, если ходы не воспроизводятся или не приводят к текущей позиции: например,
+        у партии со случайной расстановкой, созданной до появления start_fen.
+        """
+        fens = engine.replay(self.pgn, self.start_fen or engine.START_FEN)
+        if fens[-1] != self.fen:
+            raise ValueError("unknown start position")
+        return fens
+
     @property
     def active_mini(self):
         if not self.pgn:
@@ -59,49 +111,452 @@ class Game:
             "step": self.step,
             "players": self.players,
             "winner": self.winner,
+            **self.get_clock_for_client(),
+            "active_mini": self.active_mini
+        }
+
+    def get_clock_for_client(self):
+        """Часы партии в формате get_state_for_client."""
+        return {
             "left_time": [round(i, 2) for i in self.left_time],
             "last_move_time": self.last_move_time.timestamp() if self.last_move_time != -1 else None,
-            "active_mini": self.active_mini
         }
 
 
+@dataclass
+class Move:
+    """Запись журнала ходов: один ход партии."""
+    game_id: int
+    ply: int  # Номер полухода, равен длине pgn до хода
+    cell: int  # Клетка на всей доске: 9 * row + col
+    left_time: Optional[List[float]] = None  # Часы обеих сторон после хода
+    created_at: Optional[datetime.datetime] = None
+    id: int = None
+
+
+@dataclass
+class PlayerGame:
+    """Участие игрока в партии (таблица player_games)."""
+    player_id: int
+    game_id: int
+    id: int = None
+
+
 @dataclasses.dataclass
 class Player:
     username: str
     password: str
     id: int = None
-    games: list[int] = dataclasses.field(default_factory=list)
+    created_at: Optional[datetime.datetime] = None
+
+
+class ScheduledCall:
+    """Отложенный вызов в TimerService."""
+
+    def __init__(self, deadline, function, args, kwargs):
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.version = 0
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def alive(self):
+        return not (self.cancelled or self.fired)
+
+
+def start_thread(function, *args, **kwargs) -> threading.Thread:
+    """Фоновая задача в потоке-демоне: замена socketio.start_background_task вне сервера."""
+    thread = threading.Thread(target=function, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+class TimerService:
+    """
+    Единый планировщик для часов всех партий: куча дедлайнов, которую обслуживает
+    одна фоновая задача. schedule/extend/cancel — O(log n). Продление кладет в кучу
+    новую запись, устаревшие записи отбрасываются при извлечении.
+
+    start_background_task и create_event — функции сервера (socketio.start_background_task,
+    socketio.server.eio.create_event): под eventlet цикл работает гринлетом, и сработавшие
+    вызовы могут рассылать события. По умолчанию — поток и threading.Event. Цикл спит до
+    ближайшего дедлайна; новый более ранний дедлайн будит его через событие.
+    """
+
+    def __init__(self, start_background_task=None, create_event=None):
+        self.start_background_task = start_background_task or start_thread
+        self._wakeup = (create_event or threading.Event)()
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _push(self, call: ScheduledCall):
+        heapq.heappush(self._heap, (call.deadline, next(self._counter), call.version, call))
+        if not self._started:
+            self._started = True
+            self.start_background_task(self._run)
+        elif self._heap[0][3] is call:
+            # Дедлайн раньше того, до которого спит цикл
+            self._wakeup.set()
+
+    def schedule(self, delay, function, args=None, kwargs=None) -> ScheduledCall:
+        call = ScheduledCall(time.monotonic() + delay, function, list(args or []), dict(kwargs or {}))
+        with self._lock:
+            self._push(call)
+        return call
+
+    def extend(self, call: ScheduledCall, seconds):
+        with self._lock:
+            if not call.alive:
+                return
+            call.deadline += seconds
+            call.version += 1
+            self._push(call)
+
+    def cancel(self, call: ScheduledCall):
+        with self._lock:
+            call.cancelled = True
+
+    def _next_call(self) -> tuple[Optional[ScheduledCall], Optional[float]]:
+        """(сработавший вызов, 0) или (None, сколько спать до дедлайна; None — до нового вызова)."""
+        with self._lock:
+            while self._heap and (not self._heap[0][3].alive or self._heap[0][2] != self._heap[0][3].version):
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None, None
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                return None, delay
+            call = heapq.heappop(self._heap)[3]
+            call.fired = True
+            return call, 0
+
+    def _run(self):
+        while True:
+            call, delay = self._next_call()
+            if call is None:
+                self._wakeup.wait(delay)
+                # Вызов, добавленный после wait, учтет следующий _next_call
+                self._wakeup.clear()
+                continue
+            # Отдельная задача на вызов: ожидание блокировки партии не задерживает другие часы
+            self.start_background_task(self._fire, call)
+
+    @staticmethod
+    def _fire(call: ScheduledCall):
+        try:
+            call.function(*call.args, **call.kwargs)
+        except Exception:
+            traceback.print_exc()
 
 
 class ExtendableTimer:
-    def __init__(self, interval, function, args=None, kwargs=None):
+    """Часы партии поверх общего TimerService (без отдельного потока на таймер)."""
+
+    def __init__(self, interval, function, args=None, kwargs=None, *, service: TimerService):
         self.interval = interval
         self.function = function
         self.args = args if args is not None else []
         self.kwargs = kwargs if kwargs is not None else {}
+        self.service = service
         self.timer = None
         self.start_time = None
 
     def start(self):
         self.start_time = time.time()
-        self.timer = threading.Timer(self.interval, self.function, self.args, self.kwargs)
-        self.timer.start()
+        self.timer = self.service.schedule(self.interval, self.function, self.args, self.kwargs)
 
     def extend(self, additional_seconds):
-        if self.timer and self.timer.is_alive():
-            # Вычисляем сколько времени осталось
-            elapsed = time.time() - self.start_time
-            remaining = self.interval - elapsed
-
-            # Отменяем текущий таймер
-            self.timer.cancel()
-
-            # Создаем новый таймер с увеличенным временем
-            new_interval = remaining + additional_seconds
-            self.interval = elapsed + new_interval  # Обновляем общее время
-            self.timer = threading.Timer(new_interval, self.function, self.args, self.kwargs)
-            self.timer.start()
+        if self.timer and self.timer.alive:
+            self.interval += additional_seconds  # Обновляем общее время
+            self.service.extend(self.timer, additional_seconds)
 
     def cancel(self):
         if self.timer:
-            self.timer.cancel()
+            self.service.cancel(self.timer)
+
+
+class StripedLocks:
+    """
+    Полосатые блокировки: ключ (id партии) отображается на одну из stripes блокировок.
+    События одной партии выполняются по очереди, разных партий — параллельно
+    (если не попали в одну полосу). Ведется глубина очереди: сколько вызовов
+    сейчас ждут или держат каждую полосу.
+    lock_factory создает блокировку полосы. Под eventlet без monkey_patch все гринлеты
+    живут в одном потоке, и threading.RLock их не разделяет — нужна блокировка eventlet
+    (eventlet.semaphore.Semaphore). Блокировки не реентерабельны: hold не вкладываются.
+    """
+
+    def __init__(self, stripes: int = 64, lock_factory=threading.Lock):
+        self._locks = [lock_factory() for _ in range(stripes)]
+        self._depth = [0] * stripes
+        self._meta = threading.Lock()
+        self.max_depth = 0
+        self.acquired = 0
+        self.contended = 0
+
+    @contextmanager
+    def hold(self, key: int):
+        index = hash(key) % len(self._locks)
+        with self._meta:
+            self._depth[index] += 1
+            self.max_depth = max(self.max_depth, self._depth[index])
+            self.acquired += 1
+            if self._depth[index] > 1:
+                self.contended += 1
+        try:
+            with self._locks[index]:
+                yield
+        finally:
+            with self._meta:
+                self._depth[index] -= 1
+
+    def stats(self) -> dict:
+        with self._meta:
+            return {
+                "stripes": len(self._locks),
+                "depth": sum(self._depth),
+                "busiest_stripe": max(self._depth),
+                "max_depth": self.max_depth,
+                "acquired": self.acquired,
+                "contended": self.contended,
+            }
+
+
+class SpectatorFeed:
+    """
+    Рассылка зрителям партии: вместо события на каждый ход в комнату spectate-{id}
+    раз в window секунд уходит один снимок состояния каждой изменившейся партии.
+    Снимок сериализуется один раз на всю комнату; зрители, у которых не отправлено
+    больше max_backlog пакетов, пропускают рассылку (следующий снимок их догонит),
+    а после max_skips пропусков подряд отключаются.
+    """
+
+    def __init__(self, socketio, snapshot, window: float = 0.25, max_backlog: int = 16, max_skips: int = 20):
+        # snapshot(game_id) -> полное состояние партии или None
+        self.socketio = socketio
+        self.snapshot = snapshot
+        self.window = window
+        self.max_backlog = max_backlog
+        self.max_skips = max_skips
+        self._pending: set[int] = set()
+        self._skips: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def room(game_id: int) -> str:
+        return f"spectate-{game_id}"
+
+    def start(self):
+        self.socketio.start_background_task(self._run)
+
+    def publish(self, game_id: int):
+        """Отмечает, что состояние партии изменилось; O(1) и не зависит от числа зрителей."""
+        with self._lock:
+            self._pending.add(game_id)
+
+    def forget(self, sid: str):
+        """Забывает счетчик пропусков отключившегося зрителя."""
+        self._skips.pop(sid, None)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.window)
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for game_id in pending:
+                try:
+                    self._broadcast(game_id)
+                except Exception:
+                    traceback.print_exc()
+
+    def _broadcast(self, game_id: int):
+        state = self.snapshot(game_id)
+        if state is None:
+            return
+        room = self.room(game_id)
+        slow = self._slow_consumers(room)
+        self.socketio.emit("update_state", state, to=room, skip_sid=slow or None)
+
+    def _slow_consumers(self, room: str) -> list[str]:
+        server = self.socketio.server
+        slow = []
+        for sid, eio_sid in list(server.manager.get_participants("/", room)):
+            socket = server.eio.sockets.get(eio_sid)
+            queue = getattr(socket, "queue", None)
+            if queue is None or queue.qsize() <= self.max_backlog:
+                self._skips.pop(sid, None)
+                continue
+            self._skips[sid] = self._skips.get(sid, 0) + 1
+            if self._skips[sid] >= self.max_skips:
+                del self._skips[sid]
+                server.disconnect(sid)
+            slow.append(sid)
+        return slow
+
+
+class PresenceTracker:
+    """
+    Присутствие игроков в партиях по Socket.IO-соединениям.
+    Клиент присылает heartbeat с интервалом своей роли (intervals); соединение без heartbeat
+    дольше grace интервалов считается пропавшим. Интервалы ролей разные: игроку активной
+    партии важна быстрая индикация, зрителям и ожидающим в лобби — нет.
+    on_change(game_id, online) вызывается только при изменении множества игроков онлайн.
+    """
+
+    def __init__(self, socketio, intervals: dict[str, float], on_change, grace: float = 2.5):
+        self.socketio = socketio
+        self.intervals = intervals
+        self.on_change = on_change
+        self.grace = grace
+        # sid -> [game_id, player_id или None, роль, время последнего heartbeat]
+        self._sockets: dict[str, list] = {}
+        # game_id -> sid соединений партии: пересчет онлайна не перебирает все соединения
+        self._games: dict[int, set[str]] = {}
+        # Соединения каждой роли в порядке последнего heartbeat: sweep смотрит только в начало
+        self._seen: dict[str, OrderedDict] = {role: OrderedDict() for role in intervals}
+        self._online: dict[int, frozenset[int]] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.socketio.start_background_task(self._run)
+
+    def connect(self, sid: str, game_id: int, player_id: Optional[int], role: str) -> float:
+        """Регистрирует соединение; возвращает интервал heartbeat для клиента."""
+        with self._lock:
+            previous = self._remove(sid)
+            self._sockets[sid] = [game_id, player_id, role, time.monotonic()]
+            self._games.setdefault(game_id, set()).add(sid)
+            self._seen[role][sid] = None
+        if previous is not None and previous[0] != game_id:
+            self._update(previous[0])
+        self._update(game_id)
+        return self.intervals[role]
+
+    def touch(self, sid: str):
+        with self._lock:
+            entry = self._sockets.get(sid)
+            if entry is not None:
+                entry[3] = time.monotonic()
+                self._seen[entry[2]].move_to_end(sid)
+
+    def disconnect(self, sid: str):
+        with self._lock:
+            entry = self._remove(sid)
+        if entry is not None:
+            self._update(entry[0])
+
+    def online(self, game_id: int) -> frozenset[int]:
+        return self._online.get(game_id, frozenset())
+
+    def sweep(self):
+        """Удаляет соединения, которые давно не присылали heartbeat."""
+        now = time.monotonic()
+        games = set()
+        with self._lock:
+            for role, seen in self._seen.items():
+                timeout = self.grace * self.intervals[role]
+                while seen:
+                    sid = next(iter(seen))
+                    if now - self._sockets[sid][3] <= timeout:
+                        break
+                    games.add(self._remove(sid)[0])
+        for game_id in games:
+            self._update(game_id)
+
+    def _remove(self, sid: str) -> Optional[list]:
+        """Удаляет соединение из всех индексов; вызывается под _lock."""
+        entry = self._sockets.pop(sid, None)
+        if entry is not None:
+            sids = self._games[entry[0]]
+            sids.discard(sid)
+            if not sids:
+                del self._games[entry[0]]
+            del self._seen[entry[2]][sid]
+        return entry
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(min(self.intervals.values()))
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+
+    def _update(self, game_id: int):
+        with self._lock:
+            online = frozenset(
+                self._sockets[sid][1] for sid in self._games.get(game_id, ())
+                if self._sockets[sid][1] is not None
+            )
+            changed = online != self._online.get(game_id, frozenset())
+            if online:
+                self._online[game_id] = online
+            else:
+                self._online.pop(game_id, None)
+        if changed:
+            self.on_change(game_id, online)
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш на max_size записей со счетчиками попаданий и промахов.
+    Если задан ttl, запись живет не дольше ttl секунд с момента записи.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items: OrderedDict = OrderedDict()
+        # Момент устаревания записей (по time.monotonic), только при заданном ttl
+        self.expires: dict = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return default
+            if self.ttl is not None and self.expires[key] <= time.monotonic():
+                del self.items[key], self.expires[key]
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if self.ttl is not None:
+                self.expires[key] = time.monotonic() + self.ttl
+            while len(self.items) > self.max_size:
+                oldest, _ = self.items.popitem(last=False)
+                self.expires.pop(oldest, None)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.expires.pop(key, None)
+            return self.items.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.expires.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items and (self.ttl is None or self.expires[key] > time.monotonic())
+
+    def stats(self) -> dict:
+        return {"size": len(self.items), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self.items)